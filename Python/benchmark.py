@@ -0,0 +1,276 @@
+"""Latency and jitter benchmarks, run against the hardware simulator.
+
+Drives `main.ReadInput` with scripted commands through a pipe (in place of
+stdin) and times the hardware events recorded by the simulator. Results
+are printed as JSON to compare releases:
+
+    python benchmark.py > bench.json
+    python benchmark.py --quick -o bench.json
+
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+os.environ['PIALARM_SIMULATE'] = '1'  # before the hardware modules are imported
+# Don't take over the socket or append to the log of a running main.py
+WORK_DIR = tempfile.mkdtemp(prefix='pialarm-benchmark-')
+os.environ['PIALARM_LOG'] = os.path.join(WORK_DIR, 'pialarm.log')
+
+from modules import config as cg  # noqa: E402
+from modules import alarm, effects, gpio, lcd, protocol, sequences, simulator, tm1637  # noqa: E402
+from modules import weather  # noqa: E402
+import main  # noqa: E402
+
+log = simulator.log
+
+
+def stats(samples):
+    """Summarize timings (in seconds) as milliseconds."""
+    samples = sorted(samples)
+    if not samples:
+        return {'count': 0}
+    count = len(samples)
+    mean = sum(samples) / count
+    return {
+        'count': count,
+        'mean_ms': round(mean * 1000, 4),
+        'min_ms': round(samples[0] * 1000, 4),
+        'p50_ms': round(samples[count // 2] * 1000, 4),
+        'p95_ms': round(samples[min(int(count * 0.95), count - 1)] * 1000, 4),
+        'max_ms': round(samples[-1] * 1000, 4),
+        'stdev_ms': round((sum((x - mean) ** 2 for x in samples) / count) ** 0.5 * 1000, 4),
+    }
+
+
+def wait_for_event(kinds, since, timeout=2.0):
+    """Return the time of the first event of `kinds` recorded after `since`."""
+    deadline = cg.monotonic() + timeout
+    while cg.monotonic() < deadline:
+        for event in log.events(since=since):
+            if event[1] in kinds:
+                return event[0]
+        time.sleep(0.0002)
+    return None
+
+
+#
+# Benchmarks
+#
+
+
+def bench_stdin(pipe, count):
+    """Time from writing a command to stdin to the first hardware event."""
+    buzzer = cg.get_pin('Haptics', 'pin_buzzer')
+    scripts = [
+        # (name, command, variants, events, prepare)
+        ('all_off', '[all_off]', [''], ('pwm',), lambda: cg.set_pwm(buzzer, 0.5, quiet=True)),
+        ('pwm_resync', '[pwm_resync]', [''], ('pwm',), None),
+        ('lcd_brightness', '[lcd] @>display:>>{}', ['alt', 'on', 'alt', 'off'], ('pwm',), None),
+        ('lcd_message', "[lcd] @>message:>>['Bench {}', 'Line 2'] @>delay:>>60",
+         range(10), ('lcd',), None),
+        ('clock_brightness', '[clock] @>display:>>{}', [0.2, 0.9], ('output',), None),
+    ]
+    results = {}
+    for name, command, variants, kinds, prepare in scripts:
+        samples, missed = [], 0
+        for idx in range(count):
+            if prepare:
+                prepare()
+            since = log.mark()
+            start = cg.monotonic()
+            os.write(pipe, command.format(variants[idx % len(variants)]) + '\n')
+            seen = wait_for_event(kinds, since)
+            if seen is None:
+                missed += 1
+            else:
+                samples.append(seen - start)
+        results[name] = dict(stats(samples), missed=missed)
+    lcd.stop_weather()
+    return results
+
+
+def bench_alarm(stages, duration):
+    """Compare the alarm stage start times to the sequence timing."""
+    shaker = cg.get_pin('Haptics', 'pin_shaker')
+    raw = {'delay': 0, 'stages': [
+        {'duration': duration, 'pwm': {'shaker': round(0.1 * (idx + 1), 2)},
+         'effect': {'type': 'beep', 'period': 0.4}} for idx in range(stages)]}
+    session = alarm.AlarmSession(sequences.compile_sequence('benchmark', raw))
+    since = log.mark()
+    session.run()
+    starts = {}
+    for time_, kind, pin, value, _text in log.events('pwm', since=since):
+        if pin == shaker and value > 0:
+            starts.setdefault(round(value, 2), time_)
+    times = [starts[key] for key in sorted(starts)]
+    jitter = [abs(end - begin - duration) for begin, end in zip(times, times[1:])]
+    return dict(stats(jitter), stages_seen=len(times))
+
+
+def bench_player(frames, frame_rate):
+    """Lateness of each keyframe of an effect played at a frame rate."""
+    pin = cg.get_pin('Haptics', 'pin_buzzer')
+    timeline = effects.sample(lambda counter: {pin: (counter * frame_rate % 50) / 100.0},
+                              duration=frames / float(frame_rate), step=1.0 / frame_rate)
+    cg.set_pwm(pin, 1.0, quiet=True)  # so the first keyframe is written too
+    since = log.mark()
+    start = cg.monotonic()
+    player = effects.Player(timeline)
+    player.play()
+    scheduled = iter(timeline.times)
+    lateness = [event[0] - start - next(scheduled) for event in log.events('pwm', since=since)]
+    return dict(stats(lateness), writes=player.writes)
+
+
+def bench_tm1637(display, count):
+    """Time writing a frame to the TM1637 and count the pin transitions."""
+    display.flush()
+    since = log.mark()
+    samples = []
+    for idx in range(count):
+        digits = [idx % 10, (idx // 10) % 10, (idx // 100) % 10, 0]
+        start = time.time()
+        display.show(digits).result()  # queued for the display thread
+        samples.append(time.time() - start)
+    transitions = log.summary(since)['output']
+    return dict(stats(samples), transitions_per_frame=transitions / float(count))
+
+
+def bench_byte_transmit(count):
+    """Time sending one byte to the TM1637 with each GPIO backend.
+
+    `rpi` goes through the simulator (RPi.GPIO is not loaded by the
+    benchmark) and `mmap` writes to a file-backed stand-in for /dev/gpiomem.
+
+    """
+    clk = cg.get_pin('7Segment', 'clk')
+    dio = cg.get_pin('7Segment', 'dio')
+    path = os.path.join(tempfile.gettempdir(), 'pialarm-gpiomem')
+    results = {}
+    try:
+        for bus in (gpio.RPiGPIO(), gpio.MmapGPIO(path)):
+            display = tm1637.TM1637(clk, dio, bus=bus)
+            display.write_byte(0)  # precomputes the mmap waveforms
+            samples = []
+            for idx in range(count):
+                start = time.time()
+                display.write_byte(idx & 0xFF)
+                samples.append(time.time() - start)
+            results[bus.name] = stats(samples)
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+    return results
+
+
+def bench_lcd(count):
+    """Time formatting and rendering a 4 line message on the LCD (like the weather)."""
+    disp = lcd.this_disp()
+    samples = []
+    for idx in range(count):
+        sections = [['Mon-Clear 42F'], ['30%-1mm 12mph'], ['Tue-Rain {}F'.format(idx)], ['']]
+        start = time.time()
+        disp.custom_msg(sections)
+        samples.append(time.time() - start)
+    return stats(samples)
+
+
+class _Forecast(object):
+    """Serves a recorded-like hourly forecast instead of calling the WU API."""
+
+    def __init__(self, hours=36):
+        """Initializer."""
+        now = datetime.datetime(2017, 1, 2, 0)
+        self.payload = {'hourly_forecast': [self.hour(now + datetime.timedelta(hours=idx))
+                                            for idx in range(hours)]}
+
+    @staticmethod
+    def hour(when):
+        """Create one hour of forecast."""
+        return {
+            'FCTTIME': {'hour': str(when.hour), 'pretty': when.strftime('%I:%M %p %Z on %B %d'),
+                        'weekday_name_abbrev': when.strftime('%a')},
+            'wx': 'Partly Cloudy', 'condition': 'Chance of Rain',
+            'temp': {'english': '42'}, 'feelslike': {'english': '38'},
+            'wspd': {'english': '12'}, 'wdir': {'dir': 'WNW'},
+            'pop': '30', 'humidity': '64', 'snow': {'metric': '0'}, 'qpf': {'metric': '1'},
+        }
+
+    def fetch(self, req_type):
+        """Return the same forecast for every request."""
+        return self.payload
+
+
+def bench_commute(count):
+    """Time parsing the hourly forecast with `weather.commute()`."""
+    weather._WU = _Forecast()
+    samples = []
+    for idx in range(count):
+        start = time.time()
+        weather.commute()
+        samples.append(time.time() - start)
+    return stats(samples)
+
+
+def run(quick=False):
+    """Run all the benchmarks and return the results."""
+    scale = 1 if quick else 5
+    # Keep the benchmark offline and independent of the Home/Away status
+    cg.ifttt = lambda *args, **kwargs: None
+    cg.check_status = lambda: True
+
+    read_fd, write_fd = os.pipe()
+    sys.stdin = os.fdopen(read_fd)
+    reader = main.ReadInput(socket_path=os.path.join(WORK_DIR, 'pialarm.sock'))
+    reader.parsed_sysarg = True  # ignore the benchmark arguments
+    reader.Display.stop_clock()
+    cg.thread(reader.start)
+
+    try:
+        results = {
+            'stdin_to_hardware': bench_stdin(write_fd, 20 * scale),
+            'alarm_stage_jitter': bench_alarm(4 if quick else 8, 0.5),
+            'effect_frame_lateness': bench_player(30 * scale, 50),
+            'tm1637_frame': bench_tm1637(reader.Display, 50 * scale),
+            'tm1637_byte': bench_byte_transmit(200 * scale),
+            'lcd_render': bench_lcd(100 * scale),
+            'commute_parse': bench_commute(50 * scale),
+            'protocol_commands_per_sec': round(protocol.benchmark(20000 * scale)),
+        }
+    finally:
+        reader.server.shutdown()
+        reader.server.server_close()
+    return {
+        'timestamp': datetime.datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'quick': quick,
+        'events_recorded': log.count,
+        'results': results,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--quick', action='store_true', help='fewer iterations')
+    parser.add_argument('-o', '--output', help='write the JSON to a file')
+    options = parser.parse_args()
+    stdout, sys.stdout = sys.stdout, sys.stderr  # keep the JSON output clean
+    try:
+        report = json.dumps(run(options.quick), indent=2, sort_keys=True)
+    finally:
+        sys.stdout = stdout
+        shutil.rmtree(WORK_DIR, ignore_errors=True)
+    if options.output:
+        with open(options.output, 'w') as output:
+            output.write(report + '\n')
+    else:
+        print report
@@ -1,12 +1,16 @@
 """Main file."""
 
 import datetime
-import re
 import sys
-from time import sleep
 
-from modules import config as cg
-from modules import alarm, all_off, lcd, status, tests, tm1637
+# `python main.py --importtime` reports the startup time of each import
+if '--importtime' in sys.argv:
+    sys.argv.remove('--importtime')
+    from modules import importtime
+    importtime.install()
+
+from modules import config as cg  # noqa: E402
+from modules import all_off, commands, lcd, logs, metrics, protocol, server, tm1637  # noqa: E402
 
 cg.quiet_logging(False)
 
@@ -16,79 +20,42 @@ class ActionInput(object):
 
     def __init__(self, operation, args, message='', tm1637_display=False):
         """Initializer."""
-        self.delay = 1
         self.msg = message
         self.Display = tm1637_display
         operation = operation.lower().strip()
         cg.send('Acting on: {} w/ msg: {}'.format(operation, self.msg))
         """Determine the proper action based on the arguments."""
-        if re.match(operation, 'test'):
-            self._mjr('Starting tests!')
-            tests.t_hw()  # just hello world
-            # tests.t_weather()  # *watch the 1 min. API limit
-        elif re.match(operation, 'alarm'):
-            self._mjr('Starting alarm!')
-            alarm.run()
-        elif re.match(operation, 'all_off'):
-            self._mjr('Deactivating all pins')
-            all_off.deactivate()
-        elif re.match(operation, 'lcd'):
-            self._mjr('Updating Character lcd!')
-            self.lcd_logic(args)
-        elif re.match(operation, 'clock'):
-            self._mjr('Updating TM1637 Clock Module (brightness)!')
-            cg.send('**TM1637 Clock Args: {}'.format(self.msg))
-            self.Display.SetBrightness(float(args['display']))
-        elif re.match(operation, 'status'):
-            self._mjr('Starting status!')
-            arg = cg.dict_arg(args, 'arg')
-            if arg:
-                status.run(arg)
-            else:
-                status.set_led_state()
-        else:
+        if not commands.lookup(operation):
             self._mjr('Error: No known op for: {}'.format(self.msg))
-        # if any(re.match("weather", arg) for arg in args):
+            return
+        try:
+            commands.dispatch(operation, args, self)
+        except Exception as err:  # noqa
+            cg.send('Error: [{}] failed with: {}'.format(operation, err), force=True)
 
     def _mjr(self, msg):
         """Easy extra line-break print."""
         # cg.send('\n{}\n'.format(msg))
         cg.send('<*> {}'.format(msg))
 
-    def resume(self):
-        """Restart the LCD display at some delay."""
-        _delay = int(round(self.delay * 60))
-        cg.send('Delaying Weather-LCD updates for {}sec'.format(_delay))
-        sleep(_delay)
-        cg.send('Resuming weather LCD updates')
-        lcd.cycle_weather()
-
-    def lcd_logic(self, args):
-        """Toggle LCD back light / new text."""
-        cg.send('LCD Args: {}'.format(self.msg))
-        disp = cg.dict_arg(args, 'display')
-        msg = cg.dict_arg(args, 'message')
-        start = cg.dict_arg(args, 'start')
-        if disp:
-            cg.send('Case 1: Updating display brightness')
-            lcd.brightness(disp)
-        elif msg:
-            cg.send('Case 2: Received Message')
-            # Prep the display for before/after the message
-            lcd.stop_weather()
-            delay = cg.dict_arg(args, 'delay')
-            try:
-                self.delay = float(delay)
-            except:  # noqa
-                self.delay = 1
-            lcd.text(msg)
-            cg.thread(self.resume)
-        elif start:
-            cg.send('Case 3: Starting LCD_Weather()')
-            lcd.cycle_weather()
-        # insomnia = cg.dict_arg(args, "insomnia")
-        # if insomnia:
-        #     cg.send('INSOMNIA! Everything is running')
+
+@commands.register('log', schema={'level': str, 'module': str})
+def log_logic(args, context):
+    """Change log levels or dump the recent log lines."""
+    level = cg.dict_arg(args, 'level')
+    if level:
+        logs.book.set_level(level, cg.dict_arg(args, 'module'))
+    if cg.dict_arg(args, 'dump'):
+        for line in logs.book.dump():
+            cg.send(line, force=True)
+
+
+@commands.register('metrics', readonly=True)
+def metrics_logic(args, context):
+    """Return the counters and latency histograms (printed as a JSON line for STDIN)."""
+    if isinstance(context, ActionInput):
+        cg.send(metrics.to_json(), force=True)
+    return metrics.snapshot()
 
 
 class ReadInput(object):
@@ -96,12 +63,15 @@ class ReadInput(object):
 
     [`cmd`] @>`key`:>>`value` @>`key`:>>`value` ...etc
 
+    ex: `[log] @>level:>>debug @>module:>>alarm` or `[log] @>dump`
+
     """
 
-    def __init__(self):
+    def __init__(self, socket_path=server.SOCKET_PATH):
         """Initializer."""
-        self.op_regex = ur'.*\[([^\]]*)\].*'
         self.parsed_sysarg = False
+        # Answer status queries from Node without spawning status.py
+        self.server = server.serve(socket_path, context=self)
 
         # Initialize the clock (GND, VCC=3.3V)
         clock = cg.get_pin('7Segment', 'clk')
@@ -132,42 +102,20 @@ class ReadInput(object):
                 except KeyboardInterrupt:
                     sys.exit()
                     # raise Exception('Trying to exit the app?')
+                if not message:
+                    sys.exit()  # STDIN was closed by the parent app
             self.message = message.strip()
             cg.send('Raw Message: {}'.format(message))
-            if not re.match(self.op_regex, self.message):
-                raise ValueError('Argument passed does not have proper format')
-            else:
-                self.parse_input()
+            self.parse_input()
 
     def parse_input(self):
         """Parse the arguments received."""
-        chunks = self.message.split('@>')
-
-        # Parse operation and remove brackets:
-        # operation = chunks[0].strip()[1:-1]
-        matches = re.finditer(self.op_regex, chunks[0])
-        # 'next' - hack for iterable obj
-        operation = next(matches).group(1)
-        cg.send('Running Operation: {}'.format(operation))
-
-        def parse(y):
-            return y.split(':>>') if ':>>' in y else [y, 'N/A']
-
-        # Organize the args into a dict:
-        if len(chunks) > 1:
-            te = cg.try_eval  # shorthand the f_name
-            args = [parse(x) for x in chunks[1:]]
-            _arg = '{'
-            for arg in args:
-                _arg += '"{}": "{}",'.format(te(arg[0]), te(arg[1]))
-            arguments = _arg[:-1] + '}'
-            cg.send('w/ Args: {}'.format(arguments))
-            try:
-                arguments = te(arguments)
-            except:  # noqa
-                raise ValueError('Could not eval({})'.format(arguments))
-        else:
-            arguments = ''
+        try:
+            operation, arguments = protocol.parse(self.message)
+        except ValueError as err:
+            cg.send('Error: {}'.format(err), force=True)
+            return
+        cg.send('Running Operation: {} w/ Args: {}'.format(operation, arguments))
         # Decide on the appropriate action:
         ActionInput(operation, arguments, self.message, self.Display)
 
@@ -180,4 +128,7 @@ if __name__ == '__main__':
     # shutil.copyfile('{}.py'.format(pth), '{}_alt.py'.format(pth))
     # cg.send('Duplicating Status File: {}'.format(pth))
 
-    ReadInput().start()
+    reader = ReadInput()
+    if 'modules.importtime' in sys.modules:
+        sys.modules['modules.importtime'].report()
+    reader.start()
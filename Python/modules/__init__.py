@@ -1,10 +1,30 @@
-import alarm  # noqa
-import all_off  # noqa
-import bootPiBlaster  # noqa
-import config  # noqa
-import fade  # noqa
-import lcd  # noqa
-import status  # noqa
-import tests  # noqa
-import tm1637  # noqa
-import weather  # noqa
+"""PiAlarm hardware and utility modules.
+
+Submodules are only imported on first use (ex: `modules.alarm`), so that
+short-lived scripts don't pay for the LCD, weather, numpy, etc.
+
+"""
+
+import sys
+import types
+
+__all__ = ['alarm', 'all_off', 'blaster', 'bootPiBlaster', 'commands', 'config',
+           'context', 'effects', 'fade', 'gpio', 'importtime', 'lcd', 'logs', 'metrics',
+           'notify', 'protocol', 'sequences', 'server', 'simulator', 'state', 'status',
+           'tests', 'tm1637', 'weather', 'zones']
+
+
+class _LazyPackage(types.ModuleType):
+    """Package that imports a submodule when it is first accessed."""
+
+    def __getattr__(self, name):
+        if name not in __all__:
+            raise AttributeError(name)
+        __import__('{}.{}'.format(self.__name__, name))
+        return sys.modules['{}.{}'.format(self.__name__, name)]
+
+
+_package = _LazyPackage(__name__, __doc__)
+_package.__dict__.update(globals())
+_package._original = sys.modules[__name__]  # keep the globals alive
+sys.modules[__name__] = _package
@@ -1,54 +1,24 @@
 """Alarm Script."""
 
 import sys
-import time
+import threading
 
 import all_off
+import commands
 import config as cg
-import fade
+import effects
 import lcd
+import sequences
 from context import IO
 
-# FIXME: Re-implement as a thread with an interrupt Exception
-
 ###########################
 # Configuration:
 ###########################
 
 # Electronic Pin Numbering Globals:
 off_button = cg.get_pin('Input_Pins', 'off_button')
-pin_buzzer = cg.get_pin('Haptics', 'pin_buzzer')
-pin_shaker = cg.get_pin('Haptics', 'pin_shaker')
-pin_blue = cg.get_pin('RGB_Strip', 'pin_blue')
-pin_red = cg.get_pin('RGB_Strip', 'pin_red')
-pin_green = cg.get_pin('RGB_Strip', 'pin_green')
-# # TODO: Add second LED Strip
-# pin_blue2 = cg.get_pin('RGB_Strip', 'pin_blue2')
-# pin_red2 = cg.get_pin('RGB_Strip', 'pin_red2')
-# pin_green2 = cg.get_pin('RGB_Strip', 'pin_green2')
-
-# Allow shorter run time for testing with ANY argument
-if len(sys.argv) > 1:
-    # arg = cg.parse_argv(sys)
-    alarm_stage_time = [0, 5, 10, 15]
-else:
-    alarm_stage_time = [30, 180, 80, 60]
-
-step_size = 0.2
-alarm_on = True
-_running = False
-cg.quiet_logging(False)
-
-# Settings for fade_led_strip()
-max_brightness = 0.6
-last_beep, fade_stage = 0, 0
-fade_stages = [pin_green, pin_red, pin_blue,
-               pin_green, pin_red, pin_blue]
-a_s_t = alarm_stage_time[3]
-l_f_s = len(fade_stages)
-if a_s_t < l_f_s:
-    raise ValueError('a_s_t({}) not > len({})'.format(a_s_t, l_f_s))
-time_total = a_s_t / l_f_s
+
+# The stages are configured in sequences.json (see sequences.py)
 
 
 ###########################
@@ -56,14 +26,6 @@ time_total = a_s_t / l_f_s
 ###########################
 
 
-def alarm_deactivate(pin_num):
-    """Button callback on rising edge."""
-    global alarm_on
-    if IO.input(pin_num):
-        cg.send('Deactivating Alarm on {}'.format(IO.input(pin_num)))
-        alarm_on = False
-
-
 def gen_button_cb(pin_num):
     """For testing the callback function."""
     if IO.input(pin_num):
@@ -72,146 +34,232 @@ def gen_button_cb(pin_num):
         cg.send('Triggered on a falling edge from pin: {}'.format(pin_num))
 
 
-def beep(counter):
-    """Cycle through different low frequencies."""
-    global last_beep
-    if counter % 2 <= 1 and last_beep == 0:
-        cg.set_pwm(pin_buzzer, 0.2)
-        last_beep = 0.2
-    elif counter % 2 > 1 and last_beep == 0.2:
-        cg.set_pwm(pin_buzzer, 0.0)
-        last_beep = 0
+###########################
+# Alarm logic!
+###########################
 
 
-def fade_led_strip(counter):
-    """Cycle the LED Strip through various colors."""
-    global fade_stage
-    if time_total < 0.1:
-        time_step = 1
-    else:
-        time_step = (counter % time_total) + 1.0
-
-    # Increment the LED value
-    if fade_stage % 2 == 0:
-        value = 1 - (1 / time_step)
-    # Decrement the LED value
-    elif fade_stage % 2 == 1:
-        value = 1 / time_step
-
-    # Update the Alarm Electronics
-    if fade_stage < len(fade_stages):
-        # cg.set_pwm(pin_buzzer, ((counter % 2) + 1.0) / 4)
-        cg.set_pwm(fade_stages[fade_stage], max_brightness * value)
-        if time_step == time_total:
-            fade_stage += 1
-    else:
-        # cg.set_pwm(pin_buzzer, 0.5)
-        fade.all_on(max_brightness)
+class AlarmSession(object):
+    """Single run of the alarm sequence, with its own state.
 
+    session = AlarmSession().start()  # runs on a worker thread
+    session.status()
+    session.cancel()
 
-###########################
-# Alarm logic!
-###########################
+    """
 
+    def __init__(self, sequence=None):
+        """Initializer."""
+        self.sequence = sequence or sequences.library.get()
+        self.alarm_off = cg.PipeEvent()  # set by the off button or cancel()
+        self.state = 'pending'
+        self.stage = 0
+        self.loop = 0
+        self.started = None
+        self.thread = None
+        self.player = None
 
-def stop():
-    """Halt execution."""
-    global _running
-    _running = False
-    cg.send('\nAlarm Cycles Finished\n')
-    cg.ifttt('PiAlarm_SendText', {'value1': 'PiAlarm Completed'})
+    #
+    # Controls
+    #
+
+    def start(self):
+        """Run the alarm on a worker thread."""
+        self.thread = cg.thread(self.run)
+        return self
+
+    def cancel(self):
+        """Stop the alarm (same as pressing the off button)."""
+        cg.send('Cancelling alarm (state: {})'.format(self.state))
+        self.alarm_off.set()
+
+    def is_active(self):
+        """Return True until the session has finished."""
+        return self.state in ('pending', 'waiting', 'running')
+
+    def status(self):
+        """Summarize the session state."""
+        return {
+            'state': self.state,
+            'sequence': self.sequence.name,
+            'stage': self.stage,
+            'loop': self.loop,
+            'elapsed': round(cg.monotonic() - self.started, 1) if self.started else 0,
+            'cancelled': self.alarm_off.is_set(),
+        }
+
+    def alarm_deactivate(self, pin_num):
+        """Button callback on rising edge."""
+        if IO.input(pin_num):
+            cg.send('Deactivating Alarm on {}'.format(IO.input(pin_num)))
+            self.alarm_off.set()  # wakes up the alarm thread immediately
 
-    # Cleanup tasks:
-    all_off.deactivate()
-    IO.remove_event_detect(off_button)
     #
-    # IO.cleanup()  # Removed to avoid interference with clock
+    # Sequence
     #
-    # release_pwm(pin_shaker)
-    # etc...
-    # # Then stop pi-blaster for good measure:
-    # stopPiB = "sudo kill $(ps aux | grep [b]laster | awk '{print $2}')"
-    # subprocess.call(stopPiB, shell=True)
-
-
-def start(user_home):
-    """Start alarm sequence."""
-    global fade_stage, _running, alarm_on
-    _running = True
-    stage, stage3_rep_counter = 1, 0
-
-    cg.send('Set IO mode and event detection')
-    IO.setwarnings(False)
-    IO.setmode(IO.BCM)
-    IO.setup(off_button, IO.IN)
-    IO.add_event_detect(off_button, IO.RISING, callback=alarm_deactivate, bouncetime=300)
-
-    while stage < 4 and stage3_rep_counter < 3 and user_home:
-        all_off.deactivate()
-        cg.send('\nStarting Stage: {}'.format(stage) +
-                ' for {} seconds'.format(alarm_stage_time[stage]))
-
-        current_time = 0
-        # Stage 1 - Green LED Strip for 1 minute
-        if stage == 1 and alarm_on:
-            cg.send('Configuring Stage 1')
-            cg.set_pwm(pin_green, 0.2)
-            cg.set_pwm(pin_red, 0.2)
-            cb = False
-        # Stage 2 - Purple LED Strip and Buzzer
-        if stage == 2 and alarm_on:
-            cg.send('Configuring Stage 2')
-            cg.set_pwm(pin_blue, 0.5)
-            cg.set_pwm(pin_red, 0.5)
-            cg.set_pwm(pin_buzzer, 0.1)
-            cb = beep
-        # Stage 3 - LED Strip, Bed Shaker, and Buzzer
-        if stage == 3 and alarm_on:
-            cg.send('Configuring Stage 3')
-            cg.set_pwm(pin_shaker, 1)
-            cg.set_pwm(pin_buzzer, 0.5)
-            cb = fade_led_strip
-
-        # Run alarm and check for button interrupt:
-        while alarm_on and current_time < alarm_stage_time[stage]:
-            time.sleep(step_size)
-            current_time += step_size
-            if cb:
-                cb(current_time)
-        cg.send('Completed Step #{0}'.format(stage))
-
-        # Prep for the next loop:
-        if stage == 3 and alarm_on:
+
+    def wait_stage(self, duration, timeline=None):
+        """Play the stage effects until the end of the stage (or the off button).
+
+        The keyframes are timed from a monotonic clock, so the stage doesn't
+        drift and the thread only wakes up when a PWM value changes.
+
+        """
+        self.player = effects.Player(timeline or effects.Timeline(), self.alarm_off)
+        self.player.play(duration)
+
+    def stop(self):
+        """Halt execution."""
+        if self.state == 'running':
+            self.state = 'cancelled' if self.alarm_off.is_set() else 'finished'
+        cg.send('\nAlarm Cycles Finished ({})\n'.format(self.state))
+
+        # Cleanup tasks:
+        try:
             all_off.deactivate()
-            cg.send('\nLooping back through Stage 3')
-            time.sleep(7)
-            fade_stage = 0
-            stage3_rep_counter += 1
-        else:
-            stage += 1
-        current_time = 0
-        user_home = cg.check_status()
-        cg.send('Checking home (= {}) before next loop'.format(user_home))
-    stop()
-
-
-def run():
-    """Check state and start alarm if ready."""
-    global _running, alarm_on
-    user_home = cg.check_status()
-    alarm_on = True
-    if _running:
-        _err = 'ERROR: ALARM IS ALREADY RUNNING!'
-        cg.send(_err)
-        cg.ifttt('PiAlarm_SendText', {'value1': _err})
-    elif user_home:
-        lcd.brightness('alt')
-        cg.ifttt('PiAlarm_SendText', {'value1': '** PiAlarm Started! **'})
-        time.sleep(alarm_stage_time[0])  # let text alert go out
-        start(cg.check_status())
+        finally:
+            IO.remove_event_detect(off_button)
+        cg.ifttt('PiAlarm_SendText', {'value1': 'PiAlarm Failed' if self.state == 'failed'
+                                      else 'PiAlarm Completed'})
+        #
+        # IO.cleanup()  # Removed to avoid interference with clock
+        #
+        # release_pwm(pin_shaker)
+        # etc...
+        # # Then stop pi-blaster for good measure:
+        # stopPiB = "sudo kill $(ps aux | grep [b]laster | awk '{print $2}')"
+        # subprocess.call(stopPiB, shell=True)
+
+    def run_stages(self, user_home):
+        """Start alarm sequence."""
+        self.state = 'running'
+        try:
+            self._run_stages(user_home)
+        except Exception:
+            self.state = 'failed'
+            raise
+        finally:
+            # Always turn everything off, even if a stage failed
+            self.stop()
+
+    def _run_stages(self, user_home):
+        """Loop through the stages (see run_stages)."""
+        cg.send('Set IO mode and event detection')
+        IO.setwarnings(False)
+        IO.setmode(IO.BCM)
+        IO.setup(off_button, IO.IN)
+        IO.add_event_detect(off_button, IO.RISING, callback=self.alarm_deactivate, bouncetime=300)
+
+        for idx, stage in enumerate(self.sequence.stages):
+            if self.alarm_off.is_set() or not user_home:
+                break
+            self.stage = idx + 1
+            for loop in range(stage.repeat):
+                if self.alarm_off.is_set() or not user_home:
+                    break
+                self.loop = loop
+                all_off.deactivate()
+                cg.send('\nStarting Stage: {} ({})'.format(self.stage, stage.name) +
+                        ' for {} seconds'.format(stage.duration))
+                cg.set_pwm_many(stage.pwm)
+
+                # Run alarm and check for button interrupt:
+                self.wait_stage(stage.duration, stage.timeline)
+                cg.send('Completed Step #{0}'.format(self.stage))
+
+                # Prep for the next loop:
+                if loop + 1 < stage.repeat and not self.alarm_off.is_set():
+                    all_off.deactivate()
+                    cg.send('\nLooping back through Stage {}'.format(self.stage))
+                    self.alarm_off.wait(stage.pause)
+                user_home = cg.check_status()
+                cg.send('Checking home (= {}) before next loop'.format(user_home))
+
+    def run(self):
+        """Check state and start alarm if ready (blocks until finished).
+
+        An error ends the session as 'failed' (so a new alarm can start).
+
+        """
+        self.started = cg.monotonic()
+        try:
+            if cg.check_status():
+                self.state = 'waiting'
+                lcd.brightness('alt')
+                cg.ifttt('PiAlarm_SendText', {'value1': '** PiAlarm Started! **'})
+                self.alarm_off.wait(self.sequence.delay)  # let text alert go out
+                self.run_stages(cg.check_status())
+            else:
+                self.state = 'away'
+                cg.ifttt('PiAlarm_SendText', {'value1': 'User away, no PiAlarm'})
+        except Exception as err:  # noqa
+            self.state = 'failed'
+            cg.send('Error: Alarm failed in stage {} with: {}'.format(self.stage, err), force=True)
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def current():
+    """Return the latest AlarmSession (or None)."""
+    return _session
+
+
+def start(sequence='default'):
+    """Start a new alarm session, unless one is already running."""
+    global _session
+    try:
+        sequence = sequences.library.get(sequence)
+    except (KeyError, ValueError, EnvironmentError) as err:
+        cg.send('ERROR: Could not load alarm sequence `{}`: {}'.format(sequence, err), force=True)
+        return None
+    with _session_lock:
+        if _session and _session.is_active():
+            _err = 'ERROR: ALARM IS ALREADY RUNNING!'
+            cg.send(_err)
+            cg.ifttt('PiAlarm_SendText', {'value1': _err})
+            return None
+        _session = AlarmSession(sequence).start()
+        return _session
+
+
+def run(sequence='default'):
+    """Run an alarm session and wait for it to finish."""
+    session = start(sequence)
+    if session:
+        session.thread.join()
+
+
+@commands.register('alarm', schema={'sequence': str})
+def on_alarm(args, context):
+    """Start the alarm without blocking the input loop."""
+    cg.send('<*> Starting alarm!')
+    start(args.get('sequence', 'default'))
+
+
+@commands.register('alarm_cancel')
+def on_alarm_cancel(args, context):
+    """Stop the running alarm."""
+    if _session and _session.is_active():
+        _session.cancel()
     else:
-        cg.ifttt('PiAlarm_SendText', {'value1': 'User away, no PiAlarm'})
+        cg.send('No alarm to cancel')
+
+
+@commands.register('alarm_status', readonly=True)
+def on_alarm_status(args, context):
+    """Return the state of the latest alarm."""
+    return _session.status() if _session else {'state': 'none'}
+
+
+@commands.register('alarm_sequences', readonly=True)
+def on_alarm_sequences(args, context):
+    """List the alarm sequences (reloads sequences.json if modified)."""
+    return sequences.library.names()
 
 
 if __name__ == '__main__':
-    run()
+    cg.quiet_logging(False)
+    # ex: `python alarm.py test` for the short test sequence
+    run(cg.parse_argv(sys) if len(sys.argv) > 1 else 'default')
@@ -1,19 +1,40 @@
 """Deactivate all pins."""
 
+import commands
 import config as cg
-
-cg.quiet_logging(False)
+import zones
 
 
 def deactivate():
     """Deactivate the pins."""
     cg.send('\nStart: Deactivating all PWM pins')
-    cg.set_pwm(cg.get_pin('Haptics', 'pin_buzzer'), 0)
-    cg.set_pwm(cg.get_pin('Haptics', 'pin_shaker'), 0)
-    for pin_color in ['red', 'blue', 'green']:
-        cg.set_pwm(cg.get_pin('RGB_Strip', 'pin_{}'.format(pin_color)), 0)
+    pins = [cg.get_pin('Haptics', 'pin_buzzer'), cg.get_pin('Haptics', 'pin_shaker')]
+    for zone in zones.zone_pins():  # every RGB zone (without importing numpy)
+        pins.extend(pin for pin in zone if pin)
+    cg.set_pwm_many(dict.fromkeys(pins, 0))
     cg.send('\nEnd: Set all pins to off state [all_off.deactivate()]\n')
 
 
+@commands.register('all_off')
+def on_all_off(args, context):
+    """Deactivate all pins."""
+    cg.send('<*> Deactivating all pins')
+    deactivate()
+
+
+@commands.register('pwm', readonly=True)
+def on_pwm(args, context):
+    """Return the last duty written to each pin."""
+    return cg.pwm_snapshot()
+
+
+@commands.register('pwm_resync')
+def on_pwm_resync(args, context):
+    """Write all the known duties again, after Pi-Blaster was restarted."""
+    cg.send('<*> Resyncing PWM pins')
+    cg.resync_pwm()
+
+
 if __name__ == '__main__':
+    cg.quiet_logging(False)
     deactivate()
@@ -0,0 +1,77 @@
+"""Persistent writer for the Pi-Blaster FIFO."""
+
+import errno
+import os
+import threading
+
+DEVICE = '/dev/pi-blaster'
+
+
+def format_pwm(pin_num, percent):
+    """Format a single Pi-Blaster PWM command (ex: `22=0.40`)."""
+    return '{:02}={:0.2f}'.format(int(pin_num), float(percent))
+
+
+class PiBlaster(object):
+    """Keep the Pi-Blaster FIFO open and write commands without a shell.
+
+    Any regular file may be used as `device` to record the commands
+    instead of driving the hardware (i.e. a stand-in for testing):
+
+        writer = PiBlaster('/tmp/pi-blaster.txt')
+        writer.set_pwm_many({22: 0.4, 23: 0})
+
+    """
+
+    def __init__(self, device=DEVICE):
+        """Initializer."""
+        self.device = device
+        self._fd = None
+        self._lock = threading.Lock()
+
+    def _open(self):
+        """Open the device if not already open."""
+        if self._fd is None:
+            flags = os.O_WRONLY | os.O_APPEND | os.O_NONBLOCK
+            if not os.path.exists(self.device):
+                flags |= os.O_CREAT  # file-backed stand-in device
+            self._fd = os.open(self.device, flags, 0o644)
+        return self._fd
+
+    def close(self):
+        """Close the device."""
+        with self._lock:
+            if self._fd is not None:
+                try:
+                    os.close(self._fd)
+                finally:
+                    self._fd = None
+
+    def write(self, lines):
+        """Write a list of commands in a single `write()` call."""
+        if not lines:
+            return 0
+        payload = '\n'.join(lines) + '\n'
+        with self._lock:
+            # Retry once, in case pi-blaster was restarted (stale FIFO)
+            for attempt in range(2):
+                try:
+                    return os.write(self._open(), payload)
+                except (IOError, OSError) as err:
+                    if self._fd is not None:
+                        os.close(self._fd)
+                        self._fd = None
+                    if attempt or err.errno not in (errno.EPIPE, errno.ENXIO, errno.EBADF):
+                        raise
+
+    def set_pwm(self, pin_num, percent):
+        """Set the duty cycle of a single pin."""
+        return self.write([format_pwm(pin_num, percent)])
+
+    def set_pwm_many(self, duties):
+        """Set the duty cycle of several pins ({pin: percent}) at once."""
+        return self.write([format_pwm(pin, duties[pin]) for pin in sorted(duties)])
+
+    def release(self, pin_num):
+        """Release pin from Pi-Blaster."""
+        return self.write(['release {:02}'.format(int(pin_num))])
@@ -3,12 +3,36 @@
 import subprocess
 
 import config as cg
+import server
 
-cg.quiet_logging(False)
+# Written by bootPiBlaster.sh
+pidfile = '/tmp/pi-blaster.pid'
 
-if cg.is_running("'pi-blaster\/[p]i-blaster'"):
-    cg.send('Pi-Blaster is already running')
-else:
-    cg.send('Starting fresh instance of Pi-Blaster')
-    if cg.is_pi():
-        cg.send(subprocess.call(['bash', cg.get_path('modules/bootPiBlaster.sh')]))
+
+def resync(path=server.SOCKET_PATH):
+    """Ask main.py (if it is running) to write the known PWM duties again."""
+    try:
+        reply = server.request('pwm_resync', path=path, timeout=5.0)
+    except (IOError, OSError, ValueError) as err:
+        reply = {'ok': False, 'error': str(err)}
+    if not reply.get('ok'):
+        cg.send('Could not resync PWM pins: {}'.format(reply.get('error')))
+    return reply
+
+
+def boot():
+    """Start Pi-Blaster, unless it is already running."""
+    if cg.is_running('pi-blaster/pi-blaster', pidfile=pidfile):
+        cg.send('Pi-Blaster is already running')
+    else:
+        cg.send('Starting fresh instance of Pi-Blaster')
+        if cg.is_pi():
+            cg.send(subprocess.call(['bash', cg.get_path('modules/bootPiBlaster.sh')]))
+            # The new instance starts with every pin off, so restore the duties
+            # known to main.py
+            resync()
+
+
+if __name__ == '__main__':
+    cg.quiet_logging(False)
+    boot()
@@ -4,3 +4,6 @@ echo Manually Starting Pi Blaster
 
 # The custom list for PiAlarm:
 sudo /home/pi/pi-blaster/pi-blaster --gpio 15,24,7,8,25,16,20,21,23,19
+
+# Record the PID of the daemon for `cg.is_running()`
+pidof pi-blaster > /tmp/pi-blaster.pid
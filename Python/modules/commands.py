@@ -0,0 +1,117 @@
+"""Registry of the operations handled by main.py.
+
+Modules register their own handlers:
+
+    @commands.register('status', schema={'arg': str})
+    def on_status(args, context):
+        ...
+
+"""
+
+import Queue
+
+import config as cg
+import metrics
+
+_registry = {}
+_queue = Queue.Queue()
+_worker = None
+_dispatched = metrics.counter('commands.dispatched')
+
+# Modules that register each operation, imported on the first lookup
+# (kept in sync with the @register calls by `simtests.t_providers`)
+PROVIDERS = {
+    'alarm': 'alarm',
+    'alarm_cancel': 'alarm',
+    'alarm_sequences': 'alarm',
+    'alarm_status': 'alarm',
+    'all_off': 'all_off',
+    'clock': 'tm1637',
+    'lcd': 'lcd',
+    'ping': 'server',
+    'presence': 'status',
+    'pwm': 'all_off',
+    'pwm_resync': 'all_off',
+    'status': 'status',
+    'test': 'tests',
+}
+
+
+class Command(object):
+    """Handler for one operation."""
+
+    def __init__(self, name, handler, schema=None, background=False, readonly=False):
+        """Initializer.
+
+        schema - {key: type} to convert known arguments (ex: {'display': float})
+        background - run on the shared worker thread, instead of inline
+        readonly - has no side effects (ex: can be served to other clients)
+
+        """
+        self.name = name
+        self.handler = handler
+        self.schema = schema or {}
+        self.background = background
+        self.readonly = readonly
+
+    def validate(self, args):
+        """Convert the arguments based on the schema (ValueError if invalid)."""
+        args = dict(args or {})
+        for key, kind in self.schema.items():
+            if key in args and not isinstance(args[key], kind):
+                try:
+                    args[key] = kind(args[key])
+                except (TypeError, ValueError):
+                    raise ValueError('Invalid `{}` for [{}]: {}'.format(key, self.name, args[key]))
+        return args
+
+    def __call__(self, args, context=None):
+        """Run the handler inline."""
+        return self.handler(self.validate(args), context)
+
+
+def register(name, schema=None, background=False, readonly=False):
+    """Decorator to register a handler for an operation."""
+    def decorator(handler):
+        _registry[name] = Command(name, handler, schema, background, readonly)
+        return handler
+    return decorator
+
+
+def lookup(operation):
+    """Return the Command for an operation or None."""
+    operation = operation.lower().strip()
+    if operation not in _registry and operation in PROVIDERS:
+        __import__(PROVIDERS[operation], globals())
+    return _registry.get(operation)
+
+
+def _run_background():
+    """Worker thread for background commands."""
+    while True:
+        command, args, context = _queue.get()
+        try:
+            command.handler(args, context)
+        except Exception as err:  # noqa
+            cg.send('Error: [{}] failed with: {}'.format(command.name, err), force=True)
+        finally:
+            _queue.task_done()
+
+
+def dispatch(operation, args, context=None):
+    """Run (or queue) the handler for an operation.
+
+    Raises a KeyError for an unknown operation.
+
+    """
+    global _worker
+    command = lookup(operation)
+    if not command:
+        raise KeyError(operation)
+    _dispatched.inc()
+    if not command.background:
+        return command(args, context)
+    args = command.validate(args)
+    if not _worker:
+        _worker = cg.thread(_run_background)
+    _queue.put((command, args, context))
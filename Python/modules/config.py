@@ -1,15 +1,21 @@
 """Configuration Utilities."""
 
+import ast
 import ConfigParser
-import inspect
+import ctypes
+import errno
+import fcntl
 import os
-import subprocess
+import select
 import sys
 import threading
+import time
 
-import requests
+import logs
+import metrics
+from blaster import PiBlaster, format_pwm
 
-quiet_STDOUT = True
+_log = logs.get('config')
 
 
 #
@@ -18,25 +24,24 @@ quiet_STDOUT = True
 
 
 def send(info, force=False):
-    """Force output to parent application."""
-    if not quiet_STDOUT or force:
+    """Force output to parent application, otherwise only log the info."""
+    if force:
         print '{}'.format(info)
         sys.stdout.flush()
+    elif logs.book.modules or logs.book.level <= logs.INFO:
+        module = sys._getframe(1).f_globals.get('__name__', '').rsplit('.', 1)[-1]
+        logs.book.log(module, logs.INFO, info)
 
 
 def quiet_logging(new_value=True):
     """Toggle logging."""
-    global quiet_STDOUT
-    quiet_STDOUT = new_value
+    logs.book.set_level(logs.WARNING if new_value else logs.INFO)
 
 
 def ifttt(event, dataset={'value1': ''}):
-    """Trigger IFTTT Maker Event."""
-    key = read_ini('IFTTT', 'key', filename='secret')
-    try:
-        requests.post('https://maker.ifttt.com/trigger/{}/with/key/{}'.format(event, key), data=dataset)
-    except:  # noqa
-        print 'IFTTT Failed - possible loss of INTERNET connection'
+    """Trigger IFTTT Maker Event (queued, does not wait on the network)."""
+    import notify  # avoid a circular import
+    return notify.notifier.notify(event, dataset)
 
 
 #
@@ -44,50 +49,142 @@ def ifttt(event, dataset={'value1': ''}):
 #
 
 
-def _ini_path(filename='pins'):
-    """Get ini file path."""
+def _ini_path(filename='pins', ext='ini'):
+    """Get ini (or other data) file path."""
     cwd = os.getcwd()
     if 'Python' in cwd:
         if 'modules' in cwd:
-            return '{}/../{}.ini'.format(cwd, filename)
+            return '{}/../{}.{}'.format(cwd, filename, ext)
         else:
-            return '{}/{}.ini'.format(cwd, filename)
+            return '{}/{}.{}'.format(cwd, filename, ext)
     else:
-        return '{}/Python/{}.ini'.format(cwd, filename)
+        return '{}/Python/{}.{}'.format(cwd, filename, ext)
+
+
+class IniCache(object):
+    """Process-wide cache of parsed ini files.
+
+    Each file is parsed once and is only reloaded when its mtime (or size)
+    changes. Typed values are decoded once with `ast.literal_eval`.
+
+    """
+
+    def __init__(self):
+        """Initializer."""
+        self.hits = 0
+        self.misses = 0
+        self._files = {}  # {path: ((mtime, size), {(section, option): raw})}
+        self._typed = {}  # {(path, section, option): value}
+        self._lock = threading.Lock()
+
+    def _values(self, path):
+        """Return the raw values of an ini file, parsing it only if modified."""
+        try:
+            stat = os.stat(path)
+            version = (stat.st_mtime, stat.st_size)
+        except OSError:
+            version = None
+        with self._lock:
+            cached = self._files.get(path)
+            if cached and cached[0] == version:
+                self.hits += 1
+                return cached[1]
+            self.misses += 1
+            parser = ConfigParser.RawConfigParser()
+            parser.read(path)
+            values = {}
+            for section in parser.sections():
+                for option, raw in parser.items(section):
+                    values[(section, option)] = raw
+            self._files[path] = (version, values)
+            for key in [key for key in self._typed if key[0] == path]:
+                del self._typed[key]
+            return values
+
+    def get(self, path, section, option):
+        """Get the raw string value (KeyError if missing)."""
+        return self._values(path)[(section, option.lower())]
+
+    def get_typed(self, path, section, option):
+        """Get the value as a Python literal (int, float, etc.) or string."""
+        raw = self.get(path, section, option)
+        key = (path, section, option.lower())
+        try:
+            return self._typed[key]
+        except KeyError:
+            try:
+                value = ast.literal_eval(raw.strip())
+            except (ValueError, SyntaxError):
+                value = raw.strip()
+            self._typed[key] = value
+            return value
+
+    def invalidate(self, path=None):
+        """Drop one (or all) cached files."""
+        with self._lock:
+            for cached in ([path] if path else list(self._files)):
+                self._files.pop(cached, None)
+            self._typed.clear()
+
+    def stats(self):
+        """Return the hit/miss counters."""
+        return {'hits': self.hits, 'misses': self.misses, 'files': len(self._files)}
+
+
+ini_cache = IniCache()
 
 
 def get_pin(component, param, _eval=True):
     """Get pin numbering value from a shared ini file."""
-    raw = read_ini(component, param, filename='pins')
-    return eval(raw) if _eval else raw
+    if not _eval:
+        return read_ini(component, param, filename='pins')
+    file = _ini_path('pins')
+    try:
+        return ini_cache.get_typed(file, component, param)
+    except KeyError:
+        raise Exception('Failed to load `{}` and `{}` from: {}'.format(
+            component, param, file))
 
 
 def read_ini(component, param, filename='pins'):
     """Read ini file."""
-    config = ConfigParser.RawConfigParser()
     file = _ini_path(filename)
     try:
-        config.read(file)
-        return config.get(component, param)
-    except:  # noqa
+        return ini_cache.get(file, component, param)
+    except KeyError:
         raise Exception('Failed to load `{}` and `{}` from: {}'.format(
             component, param, file))
 
 
-def write_ini(component, param, value):
-    """Write to ini file."""
-    pin_config = ConfigParser.RawConfigParser()
-    file = _ini_path()
-    pin_config.read(file)
-    with open(file, 'w') as cfgfile:
-        pin_config.set(component, param, value)
-        pin_config.write(cfgfile)
+def write_ini(component, param, value, filename='pins'):
+    """Write to ini file.
+
+    Writers in other processes are serialized with a lock file and the new
+    file is swapped in with a rename, so readers never see a partial file.
+
+    """
+    file = _ini_path(filename)
+    with open('{}.lock'.format(file), 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            pin_config = ConfigParser.RawConfigParser()
+            pin_config.read(file)
+            pin_config.set(component, param, value)
+            tmp_file = '{}.tmp'.format(file)
+            with open(tmp_file, 'w') as cfgfile:
+                pin_config.write(cfgfile)
+                cfgfile.flush()
+                os.fsync(cfgfile.fileno())
+            os.rename(tmp_file, file)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+    ini_cache.invalidate(file)
 
 
 def check_status():
     """Return True, if alarm is to continue running, else is False."""
-    stat = get_pin('Alarm_Status', 'running', _eval=False)
-    return 'true' in stat.lower()
+    import state  # avoid a circular import
+    return state.presence.get()
 
 
 #
@@ -95,33 +192,122 @@ def check_status():
 #
 
 
-def set_pwm(pin_num, percent, quiet=False):
+_blaster = None
+
+
+def use_pwm_device(device):
+    """Direct PWM commands to a Pi-Blaster FIFO or a file-backed stand-in.
+
+    `device` may also be a writer object with the PiBlaster methods
+    (ex: `simulator.Blaster`).
+
+    """
+    global _blaster
+    if _blaster:
+        _blaster.close()
+    if isinstance(device, basestring):
+        device = PiBlaster(device)
+    _blaster = device or None
+    return _blaster
+
+
+def _pwm_writer():
+    """Return the shared Pi-Blaster writer (None when not on a Pi)."""
+    if not _blaster and is_pi():
+        use_pwm_device('/dev/pi-blaster')
+    return _blaster
+
+
+_pwm_calls = metrics.counter('pwm.calls')
+_pwm_skipped = metrics.counter('pwm.skipped')
+_pwm_pins = metrics.counter('pwm.pins_written')
+_pwm_errors = metrics.counter('pwm.errors')
+_fifo_write = metrics.histogram('pwm.fifo_write')
+
+
+def _pwm_write(method, *args):
+    """Call a Pi-Blaster writer method, but don't crash if it is not running.
+
+    Returns None if there is no writer (not on a Pi) and False if it failed.
+
+    """
+    writer = _pwm_writer()
+    if not writer:
+        return None
+    start = monotonic()
+    try:
+        return getattr(writer, method)(*args)
+    except (IOError, OSError) as err:
+        _pwm_errors.inc()
+        send('Pi-Blaster write failed ({}): {}'.format(writer.device, err), force=True)
+        return False
+    finally:
+        _fifo_write.observe(monotonic() - start)
+
+
+# Shadow register: last duty written to each pin, as sent to Pi-Blaster
+_shadow = {}
+_shadow_lock = threading.Lock()
+
+
+def set_pwm(pin_num, percent, quiet=False, force=False):
     """Run PWM commands through Pi-Blaster."""
     # ex: echo '22=0.0' > /dev/pi-blaster
-    cmd = 'echo "{:02}={:0.2f}" > /dev/pi-blaster'.format(int(pin_num), float(percent))
-    if not quiet:
-        send(cmd)
-    return False if not is_pi() else subprocess.call(cmd, shell=True)
+    return set_pwm_many({pin_num: percent}, quiet, force)
+
+
+def set_pwm_many(duties, quiet=False, force=False):
+    """Set several PWM pins ({pin: percent}) in a single Pi-Blaster write.
+
+    Pins that already have the duty are skipped, unless `force` is set.
+
+    """
+    _pwm_calls.inc()
+    with _shadow_lock:
+        changed = {}
+        for pin, percent in duties.items():
+            duty = round(float(percent), 2)
+            if force or _shadow.get(pin) != duty:
+                changed[pin] = duty
+        if not changed:
+            _pwm_skipped.inc()
+            return 0
+        _pwm_pins.inc(len(changed))
+        if not quiet and _log.enabled(logs.DEBUG):
+            _log.debug('echo "{}" > /dev/pi-blaster',
+                       ' '.join(format_pwm(pin, changed[pin]) for pin in sorted(changed)))
+        result = _pwm_write('set_pwm_many', changed)
+        if result is False:
+            for pin in changed:
+                _shadow.pop(pin, None)  # unknown state, write it next time
+        else:
+            _shadow.update(changed)
+        return result
 
 
 def release_pwm(pin_num):
     """Release pin from Pi-Blaster."""
-    cmd = 'echo "release {:02}" > /dev/pi-blaster'.format(pin_num)
-    send(cmd)
-    return subprocess.call(cmd, shell=True)
+    _log.debug('echo "release {:02}" > /dev/pi-blaster', pin_num)
+    with _shadow_lock:
+        _shadow.pop(pin_num, None)
+        return _pwm_write('release', pin_num)
 
-#
-# Try evaluating unknown inputs:
-#
 
+def pwm_snapshot():
+    """Return the last duty written to each pin ({pin: duty})."""
+    with _shadow_lock:
+        return dict(_shadow)
 
-def try_eval(raw):
-    """Try to find a True/False, Integer, etc. value in string input."""
-    raw = raw.strip()
-    try:
-        return eval(raw)
-    except:
-        return raw
+
+def resync_pwm():
+    """Write every known duty again (ex: after Pi-Blaster was restarted)."""
+    duties = pwm_snapshot()
+    send('Resyncing {} PWM pins'.format(len(duties)))
+    return set_pwm_many(duties, force=True)
+
+#
+# Command arguments:
+#
 
 
 def dict_arg(args, key):
@@ -154,13 +340,57 @@ def get_path(raw):
         return raw
 
 
-def is_running(task):
-    """Use `ps aux` to check if a script is actively running."""
-    # output = 256 if running, else = 0
-    output = os.system('ps aux | grep {}'.format(task))
-    is_active = output == 0
-    send('Is `{}` running? > {} ({})'.format(task, is_active, output))
-    return is_active
+def read_pidfile(path):
+    """Return the PID stored in a pidfile or None."""
+    try:
+        with open(path) as pidfile:
+            return int(pidfile.read().split()[0])
+    except (IOError, OSError, IndexError, ValueError):
+        return None
+
+
+def pid_alive(pid):
+    """Check if a process exists without sending it a signal."""
+    try:
+        os.kill(pid, 0)
+    except OSError as err:
+        return err.errno == errno.EPERM  # exists, but owned by root
+    return True
+
+
+def _cmdline(pid):
+    """Read the command line of a process from /proc or return None."""
+    try:
+        with open('/proc/{}/cmdline'.format(pid), 'rb') as cmdline:
+            return cmdline.read().replace('\0', ' ').strip()
+    except (IOError, OSError):
+        return None
+
+
+def find_process(task, pidfile=None):
+    """Return the PID of a process whose command line contains `task`.
+
+    The pidfile (if any) is checked first, then `/proc/*/cmdline` is scanned.
+    Nothing is forked, so this process can't match itself like `grep` did.
+
+    """
+    pid = read_pidfile(pidfile) if pidfile else None
+    if pid and pid_alive(pid) and task in (_cmdline(pid) or task):
+        return pid
+    own_pid = os.getpid()
+    for entry in os.listdir('/proc'):
+        if entry.isdigit() and int(entry) != own_pid:
+            cmdline = _cmdline(entry)
+            if cmdline and task in cmdline:
+                return int(entry)
+    return None
+
+
+def is_running(task, pidfile=None):
+    """Check if a script is actively running."""
+    pid = find_process(task, pidfile)
+    send('Is `{}` running? > {} (PID: {})'.format(task, bool(pid), pid))
+    return bool(pid)
 
 
 #
@@ -181,6 +411,123 @@ def thread(target, args=()):
     return this
 
 
+class PipeEvent(object):
+    """Replacement for threading.Event that sleeps in `select()`.
+
+    In Python 2, Event.wait(timeout) polls (up to every 50ms), while this
+    waits without waking up until set() is called or the timeout expires.
+
+    """
+
+    def __init__(self):
+        """Initializer."""
+        self._read, self._write = os.pipe()
+        self._flag = False
+        self._lock = threading.Lock()
+
+    def __del__(self):
+        """Close the pipe."""
+        os.close(self._read)
+        os.close(self._write)
+
+    def is_set(self):
+        """Return True if set."""
+        return self._flag
+
+    def set(self):
+        """Set the flag and wake up all waiting threads."""
+        with self._lock:
+            if not self._flag:
+                self._flag = True
+                os.write(self._write, 'x')
+
+    def clear(self):
+        """Reset the flag."""
+        with self._lock:
+            if self._flag:
+                self._flag = False
+                os.read(self._read, 1)
+
+    def wait(self, timeout=None):
+        """Block until set or timeout (in seconds) and return the flag."""
+        if not self._flag:
+            if timeout is not None:
+                timeout = max(timeout, 0)
+            try:
+                select.select([self._read], [], [], timeout)
+            except select.error as err:
+                if err.args[0] != errno.EINTR:
+                    raise
+        return self._flag
+
+
+class Future(object):
+    """Result of an operation running on another thread."""
+
+    def __init__(self):
+        """Initializer."""
+        self._done = threading.Event()
+        self._result = None
+        self._error = None
+
+    def set_result(self, result):
+        """Complete with a result."""
+        self._result = result
+        self._done.set()
+
+    def set_exception(self, error):
+        """Complete with an error, raised by `result()`."""
+        self._error = error
+        self._done.set()
+
+    def done(self):
+        """Check if completed."""
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        """Wait for the result (raises a RuntimeError on timeout)."""
+        if not self._done.wait(timeout):
+            raise RuntimeError('Timed out after {}s'.format(timeout))
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+
+def _load_monotonic():
+    """Find a clock that is not affected by system time changes."""
+    try:
+        from time import monotonic  # Python 3
+        return monotonic
+    except ImportError:
+        pass
+
+    class Timespec(ctypes.Structure):
+        _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+    for library in ['librt.so.1', 'libc.so.6']:
+        try:
+            clock_gettime = ctypes.CDLL(library, use_errno=True).clock_gettime
+            break
+        except (OSError, AttributeError):
+            continue
+    else:
+        return time.time
+    clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(Timespec)]
+    timespec = Timespec()
+    lock = threading.Lock()
+
+    def monotonic():
+        """Return the CLOCK_MONOTONIC time in seconds."""
+        with lock:
+            if clock_gettime(1, ctypes.byref(timespec)):  # CLOCK_MONOTONIC = 1
+                raise OSError(ctypes.get_errno(), 'clock_gettime failed')
+            return timespec.tv_sec + timespec.tv_nsec * 1e-9
+    return monotonic
+
+
+monotonic = _load_monotonic()
+
+
 # # Stop pi-blaster / or any process:
 # print os.system('sudo kill $(ps aux | grep 'pi-blaster\/[p]' +
 #                 'i-blaster' | awk '{print $2}')')
@@ -199,24 +546,22 @@ class Logger(object):
         """Initializer."""
         assert len(origin) == 6, 'Origin must be 6 letters ({} - is not)'.format(origin)
         self.__origin = origin if origin else '    br'
+        self.__log = logs.get(self.__origin.strip())
 
     def ln(self):
         """Get line number for logging."""
-        return '{:03d}'.format(inspect.currentframe().f_back.f_lineno)
+        return sys._getframe(1).f_lineno
 
-    def _format(self, ln, message):
-        return '{} (#{}): {}'.format(self.__origin, ln, message.strip())
+    def _emit(self, ln, messages):
+        """Log each message, but only format them if INFO is enabled."""
+        if self.__log.enabled(logs.INFO):
+            for message in messages:
+                self.__log.info('{} (#{:03d}): {}', self.__origin, ln, message.strip())
 
     def lit(self, ln, message, print_out=True):
         """Minor - two line comment."""
-        send(self._format(ln, message))
-        send(self._format(ln, ''))
-        send(self._format(ln, message))
+        self._emit(ln, [message, '', message])
 
     def big(self, ln, message):
         """Major - five line comment."""
-        send(self._format(ln, '__'))
-        send(self._format(ln, ''))
-        send(self._format(ln, message))
-        send(self._format(ln, ''))
-        send(self._format(ln, '__'))
+        self._emit(ln, ['__', '', message, '', '__'])
@@ -1,24 +1,48 @@
-"""Handle importing stubbed Python libraries if not on Raspberry Pi."""
+"""Handle importing stubbed Python libraries if not on Raspberry Pi.
+
+Set `PIALARM_SIMULATE=1` to use the recording simulator (see simulator.py),
+which is also used when the hardware libraries can't be imported off the Pi.
+On a Pi, a missing library raises the ImportError instead.
+
+"""
 
 import os
 import sys
 
-# Add path to stub files so stubs can be loaded if they exist
-stubs_path = os.path.expanduser('~/Developer/My-Programming-Sketchbook/Python/Stubs')
-if os.path.isdir(stubs_path):
-    sys.path.append(stubs_path)
-
-try:
-    import stub_RPiGPIO as IO
-except ImportError:
-    import RPi.GPIO as IO  # noqa
-
-try:
-    import stub_Adafruit_CharLCD as LCD
-except ImportError:
-    import Adafruit_CharLCD as LCD  # noqa
-
-try:
-    import stub_Adafruit_GPIOMCP230xx as MCP
-except ImportError:
-    import Adafruit_GPIO.MCP230xx as MCP  # noqa
+import config as cg
+import logs
+
+SIMULATE = os.environ.get('PIALARM_SIMULATE', '') not in ('', '0')
+
+if not SIMULATE:
+    # Add path to stub files so stubs can be loaded if they exist
+    stubs_path = os.path.expanduser('~/Developer/My-Programming-Sketchbook/Python/Stubs')
+    if os.path.isdir(stubs_path):
+        sys.path.append(stubs_path)
+
+    try:
+        try:
+            import stub_RPiGPIO as IO
+        except ImportError:
+            import RPi.GPIO as IO  # noqa
+
+        try:
+            import stub_Adafruit_CharLCD as LCD
+        except ImportError:
+            import Adafruit_CharLCD as LCD  # noqa
+
+        try:
+            import stub_Adafruit_GPIOMCP230xx as MCP
+        except ImportError:
+            import Adafruit_GPIO.MCP230xx as MCP  # noqa
+    except ImportError as err:
+        if cg.is_pi():
+            raise  # don't send the real PWM to the simulator
+        logs.get('context').warning('Using the hardware simulator ({})', err)
+        SIMULATE = True
+
+if SIMULATE:
+    import simulator
+    IO = simulator.gpio
+    LCD = MCP = simulator
+    simulator.install()
@@ -0,0 +1,176 @@
+"""Precompiled PWM timelines for the alarm and LED effects.
+
+An effect is compiled once into a Timeline of (time, pin, duty) keyframes,
+then a Player sends them, only writing pins whose duty actually changed:
+
+    timeline = effects.sample(lambda t: {pin: t / 10.0}, duration=10, step=0.1)
+    effects.Player(timeline).play()
+
+"""
+
+from array import array
+
+import config as cg
+import zones
+
+# Duties are quantized to the precision sent to pi-blaster (0.01)
+RESOLUTION = 100
+
+
+def quantize(duty):
+    """Convert a duty in [0, 1] to an integer step in [0, RESOLUTION]."""
+    return int(round(min(max(float(duty), 0.0), 1.0) * RESOLUTION))
+
+
+class Timeline(object):
+    """Array-backed (time, pin, duty) keyframes, sorted by time."""
+
+    def __init__(self, duration=0):
+        """Initializer."""
+        self.duration = duration
+        self.times = array('d')
+        self.pins = array('B')
+        self.duties = array('B')  # quantized, see RESOLUTION
+        self._last = {}  # last duty added per pin
+
+    def __len__(self):
+        """Return the number of keyframes."""
+        return len(self.times)
+
+    def add(self, time, pin, duty):
+        """Add a keyframe, unless the pin already has the same duty."""
+        duty = quantize(duty)
+        if self._last.get(pin) == duty:
+            return False
+        if self.times and time < self.times[-1]:
+            raise ValueError('Keyframes must be added in order ({} < {})'.format(time, self.times[-1]))
+        self._last[pin] = duty
+        self.times.append(time)
+        self.pins.append(pin)
+        self.duties.append(duty)
+        self.duration = max(self.duration, time)
+        return True
+
+    def add_many(self, time, duties):
+        """Add keyframes for several pins ({pin: duty}) at the same time."""
+        for pin in sorted(duties):
+            self.add(time, pin, duties[pin])
+
+    def frames(self):
+        """Yield (time, {pin: duty}) with the keyframes grouped by time."""
+        count = len(self.times)
+        idx = 0
+        while idx < count:
+            time = self.times[idx]
+            frame = {}
+            while idx < count and self.times[idx] == time:
+                frame[self.pins[idx]] = self.duties[idx]
+                idx += 1
+            yield time, frame
+
+
+def sample(func, duration, step, start=0):
+    """Compile a Timeline by calling `func(counter)` every step.
+
+    `func` returns {pin: duty} and is called in order, so it may keep state.
+
+    """
+    timeline = Timeline(duration)
+    ticks = int(round(duration / float(step)))
+    for tick in range(start, ticks + 1):
+        counter = round(tick * step, 6)
+        timeline.add_many(counter, func(counter))
+    return timeline
+
+
+class Player(object):
+    """Send the keyframes of a Timeline at their scheduled times.
+
+    Frames are written in a single batch and pins that already have the
+    requested duty are skipped. Keyframes for the logical color channels
+    (see zones.py) are rendered for every RGB zone in one vectorized pass.
+
+    With `max_lag`, a frame that is more than `max_lag` seconds late is
+    dropped (merged into the next frame) instead of falling further behind.
+
+    """
+
+    def __init__(self, timeline, stop_event=None, strips=None, max_lag=None):
+        """Initializer."""
+        self.timeline = timeline
+        self.stop_event = stop_event or cg.PipeEvent()
+        self.strips = strips
+        self.max_lag = max_lag
+        self.current = {}  # {pin: quantized duty} last written
+        self.rgb = [0, 0, 0]  # quantized duty of each logical channel
+        self.zone_duties = None  # last rendered zone frame
+        self.frames = 0
+        self.writes = 0
+        self.skipped = 0
+        self.dropped = 0
+
+    def stop(self):
+        """Stop playing."""
+        self.stop_event.set()
+
+    def _render_zones(self, changed):
+        """Add the zone pins that changed with the color channels."""
+        strips = self.strips = self.strips or zones.strips()
+        quantized = strips.render([duty / float(RESOLUTION) for duty in self.rgb], RESOLUTION)
+        if self.zone_duties is None:
+            # Only write the channels used by this timeline
+            used = [idx for idx in range(3) if self._used[idx]]
+            last = quantized.copy()
+            for idx in used:
+                last[idx::3] = -1
+        else:
+            last = self.zone_duties
+        self.zone_duties = quantized
+        changed.update(strips.diff(quantized, last, RESOLUTION))
+
+    def _write(self, frame):
+        """Send the pins of a frame that changed."""
+        changed = {}
+        colors = False
+        for pin, duty in frame.items():
+            if zones.is_channel(pin):
+                colors = True
+                self._used[pin - zones.CHANNEL_PIN] = True
+                self.rgb[pin - zones.CHANNEL_PIN] = duty
+            elif self.current.get(pin) != duty:
+                self.current[pin] = duty
+                changed[pin] = duty / float(RESOLUTION)
+            else:
+                self.skipped += 1
+        if colors:
+            self._render_zones(changed)
+        if changed:
+            self.writes += len(changed)
+            cg.set_pwm_many(changed)
+
+    def play(self, duration=None):
+        """Play the timeline (blocks), then wait until the end of `duration`.
+
+        Returns False if stopped early.
+
+        """
+        start = cg.monotonic()
+        self._used = [False, False, False]
+        pending = {}  # dropped frames, sent with the next one
+        for time, frame in self.timeline.frames():
+            deadline = start + time
+            if self.stop_event.wait(deadline - cg.monotonic()):
+                return False
+            self.frames += 1
+            if pending:
+                pending.update(frame)
+                frame, pending = pending, {}
+            if self.max_lag is not None and cg.monotonic() - deadline > self.max_lag:
+                self.dropped += 1
+                pending = frame
+                continue
+            self._write(frame)
+        if pending:
+            self._write(pending)
+        duration = self.timeline.duration if duration is None else duration
+        return not self.stop_event.wait(start + duration - cg.monotonic())
@@ -1,65 +1,105 @@
 """Fade LED Strip."""
 
-from time import sleep
+from array import array
 
 import config as cg
+import effects
+import zones
 
 # cg.quiet_logging(False)
-cg.quiet_logging(True)
+# cg.quiet_logging(True)  # Note: would also quiet lazily importing modules
 
-# Electronic Pin Numbering Globals:
-pin_blue = cg.get_pin('RGB_Strip', 'pin_blue')
-pin_red = cg.get_pin('RGB_Strip', 'pin_red')
-pin_green = cg.get_pin('RGB_Strip', 'pin_green')
+# Logical color channels, applied to every RGB zone (see zones.py):
+pin_blue = zones.CHANNELS['blue']
+pin_red = zones.CHANNELS['red']
+pin_green = zones.CHANNELS['green']
 
 max_brightness = 1.0
-steps = 30
 total_run_time = 60
-time_step = total_run_time / (6 * steps)  # 3 fades up, 3 down = 6
+fade_time = total_run_time / 6.0  # 3 fades up, 3 down = 6
+frame_rate = 30  # frames per second
+gamma = 2.2  # perceived brightness is not linear with the duty cycle
+
+_gamma_tables = {}
+
+
+def gamma_table(frames, gamma=gamma):
+    """Return the duties in [0, 1] of a perceptually linear fade (cached)."""
+    key = (frames, gamma)
+    if key not in _gamma_tables:
+        last = float(max(frames - 1, 1))
+        _gamma_tables[key] = array('d', [(frame / last) ** gamma for frame in range(frames)])
+    return _gamma_tables[key]
+
+
+def _compile_fade(pin, timeline, start, duration, reverse):
+    """Add a keyframe for every frame of a fade."""
+    timeline = effects.Timeline() if timeline is None else timeline
+    duration = fade_time if duration is None else duration
+    frames = int(round(duration * frame_rate)) + 1
+    table = gamma_table(frames)
+    for frame in range(frames):
+        level = table[frames - 1 - frame] if reverse else table[frame]
+        timeline.add(start + frame / float(frame_rate), pin, max_brightness * level)
+    timeline.duration = max(timeline.duration, start + duration)
+    return timeline
+
+
+def compile_fade_up(pin, timeline=None, start=0, duration=None):
+    """Add keyframes to fade brightness in the positive direction."""
+    return _compile_fade(pin, timeline, start, duration, reverse=False)
+
+
+def compile_fade_down(pin, timeline=None, start=0, duration=None):
+    """Add keyframes to fade brightness in the negative direction."""
+    return _compile_fade(pin, timeline, start, duration, reverse=True)
+
+
+def play(timeline):
+    """Play a fade at the frame rate and report the dropped frames."""
+    player = effects.Player(timeline, max_lag=1.0 / frame_rate)
+    player.play()
+    cg.send('Fade: {} frames, {} writes, {} dropped'.format(
+        player.frames, player.writes, player.dropped))
+    return player
 
 
 def fade_up(pin):
     """Fade brightness in the positive direction."""
-    for i in range(steps):
-        cg.set_pwm(pin, max_brightness * (1 - (1 / (i + 2))))
-        sleep(time_step)
+    play(compile_fade_up(pin))
 
 
 def fade_down(pin):
     """Fade brightness in the negative direction."""
-    for i in range(steps):
-        cg.set_pwm(pin, max_brightness / (i + 2))
-        sleep(time_step)
+    play(compile_fade_down(pin))
 
 
 def all_off():
     """Turn off LEDs."""
     cg.send('\nDeactivating SOME PWM pins')
-    cg.set_pwm(pin_red, 0)
-    cg.set_pwm(pin_blue, 0)
-    cg.set_pwm(pin_green, 0)
+    zones.strips().set_color((0, 0, 0))
 
 
 def all_on(max_brightness=1):
     """Set LEDs to max brightness."""
     cg.send('\nActivating all LED Strip pins')
-    cg.set_pwm(pin_red, max_brightness)
-    cg.set_pwm(pin_blue, max_brightness)
-    cg.set_pwm(pin_green, max_brightness)
+    zones.strips().set_color((max_brightness, max_brightness, max_brightness))
 
 
 def fade_rgb_strip():
     """Fade the LED strip through a full RGB sequence."""
     all_off()
 
-    cg.set_pwm(pin_red, 0.1)
-
-    fade_up(pin_green)
-    fade_down(pin_red)
-    fade_up(pin_blue)
-    fade_down(pin_green)
-    fade_up(pin_red)
-    fade_down(pin_blue)
+    timeline = effects.Timeline()
+    timeline.add(0, pin_red, 0.1)
+    for idx, (compile_fade, pin) in enumerate([(compile_fade_up, pin_green),
+                                               (compile_fade_down, pin_red),
+                                               (compile_fade_up, pin_blue),
+                                               (compile_fade_down, pin_green),
+                                               (compile_fade_up, pin_red),
+                                               (compile_fade_down, pin_blue)]):
+        compile_fade(pin, timeline, start=idx * fade_time)
+    play(timeline)
 
     all_off()
 
@@ -69,9 +109,9 @@ if __name__ == '__main__':
     fade_rgb_strip()
     raw_input('Did Fade work? (Press Key)')
 
-    cg.set_pwm(pin_red, 0.5)
+    cg.set_pwm_many(zones.strips().expand({pin_red: 0.5}))
     raw_input('Currently Red? (Press Key)')
-    cg.set_pwm(pin_green, 0.5)
+    cg.set_pwm_many(zones.strips().expand({pin_green: 0.5}))
     raw_input('Currently Green? (Press Key)')
-    cg.set_pwm(pin_blue, 0.5)
+    cg.set_pwm_many(zones.strips().expand({pin_blue: 0.5}))
     raw_input('Currently Blue? (Press Key)')
@@ -0,0 +1,162 @@
+"""GPIO backends for the bit-banged TM1637 bus.
+
+`RPiGPIO` makes one `RPi.GPIO` call per pin change. `MmapGPIO` writes the
+BCM2835 GPIO registers through `/dev/gpiomem` and replays a precomputed
+waveform (the register writes) for each byte. Any regular file can be
+mapped instead of `/dev/gpiomem` to test it off-Pi.
+
+The backend is selected with `PIALARM_GPIO`: `rpi` (default), `mmap` or the
+path of a file-backed stand-in. RPi.GPIO is used if the registers can't be
+mapped.
+
+"""
+
+import ctypes
+import mmap
+import os
+
+import logs
+from context import IO
+
+_log = logs.get('gpio')
+
+GPIOMEM = '/dev/gpiomem'
+BLOCK_SIZE = 4096
+# Register indexes (32 bit words) in the GPIO block
+GPFSEL0 = 0x00 // 4  # function select, 3 bits per pin (000: input, 001: output)
+GPSET0 = 0x1C // 4
+GPCLR0 = 0x28 // 4
+GPLEV0 = 0x34 // 4
+
+
+class RPiGPIO(object):
+    """Bus driven with RPi.GPIO (or the simulator), one call per change."""
+
+    name = 'rpi'
+
+    def setup(self, pin, direction):
+        """Set a pin as an input or an output."""
+        IO.setup(pin, direction)
+
+    def output(self, pin, level):
+        """Set the level of an output."""
+        IO.output(pin, level)
+
+    def input(self, pin):
+        """Read the level of a pin."""
+        return IO.input(pin)
+
+    def send_byte(self, clk, dio, data):
+        """Clock out a byte (LSB first), then release DIO for the ACK."""
+        for i in range(0, 8):
+            IO.output(clk, IO.LOW)
+            if (data & 0x01):
+                IO.output(dio, IO.HIGH)
+            else:
+                IO.output(dio, IO.LOW)
+            data = data >> 1
+            IO.output(clk, IO.HIGH)
+
+        IO.output(clk, IO.LOW)
+        IO.output(dio, IO.HIGH)
+        IO.output(clk, IO.HIGH)
+        IO.setup(dio, IO.IN)
+
+    def cleanup(self):
+        """Reset the pins."""
+        IO.cleanup()
+
+
+class MmapGPIO(object):
+    """Bus driven by writing the GPIO registers directly.
+
+    Each register access is a single 32 bit load or store (through a ctypes
+    array over the mapping). Set `hold` > 1 to repeat each write, if the
+    display needs a slower clock.
+
+    """
+
+    name = 'mmap'
+
+    def __init__(self, path=GPIOMEM, hold=1):
+        """Initializer."""
+        self.path = path
+        self.hold = hold
+        if not os.path.exists(path) and path != GPIOMEM:
+            with open(path, 'wb') as stand_in:
+                stand_in.write('\0' * BLOCK_SIZE)
+        fd = os.open(path, os.O_RDWR | os.O_SYNC)
+        try:
+            self.mem = mmap.mmap(fd, BLOCK_SIZE, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+        finally:
+            os.close(fd)
+        self.regs = (ctypes.c_uint32 * (BLOCK_SIZE // 4)).from_buffer(self.mem)
+        self.outputs = set()
+        self._waveforms = {}  # {(clk, dio): [register writes of each byte]}
+
+    def setup(self, pin, direction):
+        """Set a pin as an input or an output."""
+        index = GPFSEL0 + pin // 10
+        shift = (pin % 10) * 3
+        value = self.regs[index] & ~(7 << shift)
+        if direction == IO.OUT:
+            value |= 1 << shift
+            self.outputs.add(pin)
+        else:
+            self.outputs.discard(pin)
+        self.regs[index] = value
+
+    def output(self, pin, level):
+        """Set the level of an output."""
+        self.regs[GPSET0 if level else GPCLR0] = 1 << pin
+
+    def input(self, pin):
+        """Read the level of a pin."""
+        return (self.regs[GPLEV0] >> pin) & 1
+
+    def _compile(self, clk, dio, data):
+        """List the (register, value) writes that clock out a byte."""
+        steps = []
+
+        def level(pin, high):
+            steps.extend([(GPSET0 if high else GPCLR0, 1 << pin)] * self.hold)
+        for i in range(0, 8):
+            level(clk, False)
+            level(dio, data & 0x01)
+            data = data >> 1
+            level(clk, True)
+        level(clk, False)
+        level(dio, True)
+        level(clk, True)
+        return tuple(steps)
+
+    def waveform(self, clk, dio, data):
+        """Return the precomputed register writes for a byte."""
+        try:
+            return self._waveforms[clk, dio][data]
+        except KeyError:
+            self._waveforms[clk, dio] = [self._compile(clk, dio, byte) for byte in range(256)]
+            return self._waveforms[clk, dio][data]
+
+    def send_byte(self, clk, dio, data):
+        """Clock out a byte (LSB first), then release DIO for the ACK."""
+        regs = self.regs
+        for index, value in self.waveform(clk, dio, data):
+            regs[index] = value
+        self.setup(dio, IO.IN)
+
+    def cleanup(self):
+        """Set the pins used as outputs back to inputs."""
+        for pin in list(self.outputs):
+            self.setup(pin, IO.IN)
+
+
+def bus(kind=None):
+    """Create the backend selected by `kind` or `PIALARM_GPIO`."""
+    kind = kind or os.environ.get('PIALARM_GPIO', 'rpi')
+    if kind != 'rpi':
+        try:
+            return MmapGPIO(GPIOMEM if kind == 'mmap' else kind)
+        except (IOError, OSError, ValueError) as err:
+            _log.warning('Could not map the GPIO registers ({}), using RPi.GPIO', err)
+    return RPiGPIO()
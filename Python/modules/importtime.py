@@ -0,0 +1,54 @@
+"""Report the time spent importing each module (like `python -X importtime`)."""
+
+import __builtin__
+import sys
+import time
+
+_original_import = None
+_records = []  # (depth, name, self time, cumulative time)
+_stack = []  # time spent in nested imports for each active import
+_started = None
+
+
+def _timed_import(name, globals=None, locals=None, fromlist=None, level=-1):
+    """Wrapper around `__import__` that times new imports."""
+    loaded = len(sys.modules)
+    _stack.append(0.0)
+    start = time.time()
+    try:
+        return _original_import(name, globals, locals, fromlist, level)
+    finally:
+        elapsed = time.time() - start
+        nested = _stack.pop()
+        if _stack:
+            _stack[-1] += elapsed
+        if len(sys.modules) > loaded:
+            _records.append((len(_stack), name, elapsed - nested, elapsed))
+
+
+def install():
+    """Start timing imports."""
+    global _original_import, _started
+    if _original_import is None:
+        _started = time.time()
+        _original_import = __builtin__.__import__
+        __builtin__.__import__ = _timed_import
+
+
+def uninstall():
+    """Stop timing imports."""
+    global _original_import
+    if _original_import is not None:
+        __builtin__.__import__ = _original_import
+        _original_import = None
+
+
+def report(stream=sys.stderr):
+    """Write the import times (in microseconds) and the total startup time."""
+    stream.write('import time: self [us] | cumulative | imported package\n')
+    for depth, name, self_time, cumulative in _records:
+        stream.write('import time: {:>9.0f} | {:>10.0f} | {}{}\n'.format(
+            self_time * 1e6, cumulative * 1e6, '  ' * depth, name))
+    if _started:
+        stream.write('startup time: {:0.1f} ms\n'.format((time.time() - _started) * 1e3))
+    stream.flush()
@@ -1,19 +1,18 @@
 """Control LCD."""
 
+import ast
 import datetime
 import re
 from time import sleep
 
+import commands
 import config as cg
-import schedule
-import weather
+import metrics
 from context import LCD, MCP
 
 # FIXME: Trims last word in longer strings...
 # TODO: Can't handle longer words that don't have spaces inside (just cut)
 
-cg.quiet_logging(False)
-
 # Define LCD column and row size for 20x4 LCD
 lcd_columns = 20
 lcd_rows = 4
@@ -30,16 +29,25 @@ lcd_red = cg.get_pin('LCD_I2C_Pins', 'lcd_red')
 lcd_green = cg.get_pin('LCD_I2C_Pins', 'lcd_green')
 lcd_blue = cg.get_pin('LCD_I2C_Pins', 'lcd_blue')
 
-gpio = MCP.MCP23008()
-lcd = LCD.Adafruit_CharLCD(lcd_rs, lcd_en, lcd_d4, lcd_d5, lcd_d6, lcd_d7,
-                           lcd_columns, lcd_rows, lcd_backlight, gpio=gpio)
+_lcd = None
+_frames = metrics.counter('lcd.frames')
+
+
+def char_lcd():
+    """Create the MCP23008 and LCD instances on first use."""
+    global _lcd
+    if _lcd is None:
+        gpio = MCP.MCP23008()
+        _lcd = LCD.Adafruit_CharLCD(lcd_rs, lcd_en, lcd_d4, lcd_d5, lcd_d6, lcd_d7,
+                                    lcd_columns, lcd_rows, lcd_backlight, gpio=gpio)
+    return _lcd
 
 # Set brightness to something reasonable based on time of day
 now = datetime.datetime.now()
 default_b = (1.0, 0.0, 1.0)  # (0.5, 0.0, 1.0)
 off_b = (1.0, 1.0, 1.0)
 dimmed_b = (0.0, 1.0, 1.0)  # (0.7, 1.0, 0.7)
-brightness = dimmed_b if now.hour < 6 or now.hour > 21 else default_b
+initial_b = dimmed_b if now.hour < 6 or now.hour > 21 else default_b
 
 
 class CharDisp():
@@ -55,23 +63,23 @@ class CharDisp():
         """Set color & initial value to display."""
         cg.send('Manually set LCD brightness through pi-blaster')
         cg.send(' *Note all values are inverse logic (0 - high, 1 - off)')
-        self.set_disp(*brightness)
+        self.set_disp(*initial_b)
         self.custom_msg('initialized')
 
     def set_disp(self, r_, g_, b_):
         """Control the R,G,B color of LCD."""
-        cg.set_pwm(lcd_red, r_)
-        cg.set_pwm(lcd_green, g_)
-        cg.set_pwm(lcd_blue, b_)
+        cg.set_pwm_many({lcd_red: r_, lcd_green: g_, lcd_blue: b_})
 
     def custom_msg(self, raw):
         """External call to update the display with a custom message."""
         try:
-            # Check if given a list (or a text string to eval as a list)
+            # Check if given a list (or a text string of a list literal)
             if type(raw) is list:
                 sections = raw
             else:
-                sections = eval(raw)
+                sections = ast.literal_eval(raw)
+                if type(sections) is not list:
+                    raise ValueError('Not a list: {}'.format(raw))
             if len(sections) == 2:
                 sections.insert(1, self.ext(lcd_columns))
             elif len(sections) > 2:
@@ -83,13 +91,15 @@ class CharDisp():
                 comp = comp + section + self.ext(lcd_columns - len(section))
             self.update_disp(comp)
         except:  # noqa
-            comp = self.parse_message(raw)
+            comp = self.parse_message(str(raw))
             cg.send('Auto-parsed message: {}'.format(comp))
 
     def update_disp(self, msg):
         """Clear then set the new display text."""
+        lcd = char_lcd()
         lcd.clear()
         lcd.message(msg)
+        _frames.inc()
 
     #
     # Utility Functions
@@ -156,7 +166,7 @@ class CharDisp():
 
     def disp(self, status):
         """Parse text input for display state."""
-        status = status.lower()
+        status = str(status).lower()
         if re.match('on', status):
             self.set_disp(0.4, 0.7, 0.4)
             cg.send('Turned display on')
@@ -168,9 +178,9 @@ class CharDisp():
             cg.send('Turned display to alt state')
         else:
             try:
-                data = eval(status)
-                self.set_disp(data)
-            except:  # noqa
+                # ex: `(0.4, 0.7, 0.4)` for the inverted R,G,B duties
+                self.set_disp(*ast.literal_eval(status))
+            except (ValueError, SyntaxError, TypeError):
                 raise ValueError('Unknown display input: {}'.format(status))
 
     #
@@ -179,6 +189,7 @@ class CharDisp():
 
     def display_weather(self):
         """Display weather on LCD."""
+        import schedule  # only needed once weather updates are started
         if not self._scheduled:
             # Start a fresh thread for weather updates
             cg.send('Starting update_weather()')
@@ -199,6 +210,7 @@ class CharDisp():
 
     def run_sched(self):
         """Loop through the schedule to check if new task."""
+        import schedule
         cg.send('> Started Thread w/ self._c = {}'.format(self._checkSchedule))
         while self._checkSchedule:
             schedule.run_pending()
@@ -207,6 +219,7 @@ class CharDisp():
 
     def update_weather(self):
         """Request, then parse weather data for LCD display."""
+        import weather  # imports numpy and reads secret.ini
         cg.send('Running update_weather()')
         msg = []
         both_commutes = weather.commute(quiet=False)
@@ -229,30 +242,78 @@ class CharDisp():
 # Point of entry:
 #
 
-this_disp = CharDisp()
+_this_disp = None
+
+
+def this_disp():
+    """Initialize the character display on first use."""
+    global _this_disp
+    if _this_disp is None:
+        _this_disp = CharDisp()
+    return _this_disp
 
 
 def brightness(raw):
     """Set the display brightness based on raw input."""
-    this_disp.disp(raw)
+    this_disp().disp(raw)
 
 
 def text(msg):
     """Set the display text using smart parser."""
-    this_disp.custom_msg(msg)
+    this_disp().custom_msg(msg)
 
 
 def cycle_weather():
     """Update displayed weather."""
-    this_disp.display_weather()
+    this_disp().display_weather()
 
 
 def stop_weather():
     """Stop updating displayed weather."""
-    this_disp.stop_weather()
+    this_disp().stop_weather()
+
+
+def resume(delay=1):
+    """Restart the weather updates after some delay (in minutes)."""
+    _delay = int(round(delay * 60))
+    cg.send('Delaying Weather-LCD updates for {}sec'.format(_delay))
+    sleep(_delay)
+    cg.send('Resuming weather LCD updates')
+    cycle_weather()
+
+
+@commands.register('lcd', schema={'display': str})
+def lcd_logic(args, context):
+    """Toggle LCD back light / new text."""
+    cg.send('<*> Updating Character lcd!')
+    cg.send('LCD Args: {}'.format(args))
+    disp = cg.dict_arg(args, 'display')
+    msg = cg.dict_arg(args, 'message')
+    start = cg.dict_arg(args, 'start')
+    if disp:
+        cg.send('Case 1: Updating display brightness')
+        brightness(disp)
+    elif msg:
+        cg.send('Case 2: Received Message')
+        # Prep the display for before/after the message
+        stop_weather()
+        delay = cg.dict_arg(args, 'delay')
+        try:
+            delay = float(delay)
+        except:  # noqa
+            delay = 1
+        text(msg)
+        cg.thread(resume, (delay,))
+    elif start:
+        cg.send('Case 3: Starting LCD_Weather()')
+        cycle_weather()
+    # insomnia = cg.dict_arg(args, "insomnia")
+    # if insomnia:
+    #     cg.send('INSOMNIA! Everything is running')
 
 
 if __name__ == '__main__':
+    cg.quiet_logging(False)
     # Quick test of display
     brightness('alt')
     text('THIS PROBABLY WORKS!')
@@ -0,0 +1,160 @@
+"""Leveled logging, kept separate from the replies sent to the parent app."""
+
+import atexit
+import collections
+import os
+import sys
+import threading
+import time
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+LEVELS = {'debug': DEBUG, 'info': INFO, 'warning': WARNING, 'error': ERROR}
+_NAMES = dict((value, key.upper()) for key, value in LEVELS.items())
+
+# When STDOUT is piped to Node, keep the log out of it (and out of STDERR,
+# which python-shell accumulates in memory). Set `PIALARM_LOG` to use
+# another file (ex: for the benchmark)
+LOG_FILE = os.environ.get('PIALARM_LOG', '/tmp/pialarm.log')
+# Size at which the log file is moved to `pialarm.log.1` (only one is kept)
+LOG_MAX_BYTES = 1 << 20
+
+
+def to_level(raw):
+    """Convert a level name (or number) to a level number."""
+    try:
+        return LEVELS[str(raw).strip().lower()]
+    except KeyError:
+        return int(raw)
+
+
+class LogBook(object):
+    """Filter, buffer and store log records.
+
+    Messages are only formatted when their level is enabled for the module.
+    Emitted lines are written to a buffered stream (flushed on warnings and
+    at exit) and kept in a ring buffer that can be dumped on demand. The log
+    file is rotated once it reaches `max_bytes`, so it can't fill up /tmp.
+
+    """
+
+    def __init__(self, stream=None, level=INFO, size=500, path=LOG_FILE, max_bytes=LOG_MAX_BYTES):
+        """Initializer."""
+        self.level = level
+        self.modules = {}  # {module name: level} overrides
+        self.ring = collections.deque(maxlen=size)
+        self.path = path
+        self.max_bytes = max_bytes
+        self._stream = stream
+        self._file_size = None  # bytes in the log file (None if not logging to it)
+        self._lock = threading.Lock()
+
+    @property
+    def stream(self):
+        """Lazily open the log stream."""
+        if self._stream is None:
+            if sys.stdout.isatty():
+                self._stream = sys.stderr
+            else:
+                self._stream = open(self.path, 'a', 8192)
+                self._file_size = os.fstat(self._stream.fileno()).st_size
+        return self._stream
+
+    def _rotate(self):
+        """Move the full log file to `<path>.1` and start a new one."""
+        self._stream.close()
+        try:
+            os.rename(self.path, '{}.1'.format(self.path))
+        except OSError:
+            pass  # truncated below instead
+        self._stream = open(self.path, 'w', 8192)
+        self._file_size = 0
+
+    def set_level(self, level, module=None):
+        """Set the level for all modules or only for one."""
+        level = to_level(level)
+        if module:
+            self.modules[module] = level
+        else:
+            self.level = level
+
+    def enabled(self, module, level):
+        """Check if a level is enabled for a module."""
+        return level >= self.modules.get(module, self.level)
+
+    def log(self, module, level, fmt, args=()):
+        """Format and emit a record, if enabled."""
+        if level < self.modules.get(module, self.level):
+            return
+        line = '{} {:<7} {}: {}'.format(time.strftime('%H:%M:%S'), _NAMES.get(level, level),
+                                         module, fmt.format(*args) if args else fmt)
+        with self._lock:
+            self.ring.append(line)
+            self.stream.write(line + '\n')
+            if level >= WARNING:
+                self.stream.flush()
+            if self._file_size is not None:
+                self._file_size += len(line) + 1
+                if self._file_size >= self.max_bytes:
+                    self._rotate()
+
+    def flush(self):
+        """Flush the buffered stream."""
+        with self._lock:
+            if self._stream:
+                self._stream.flush()
+
+    def dump(self):
+        """Return the lines in the ring buffer."""
+        self.flush()
+        with self._lock:
+            return list(self.ring)
+
+
+class Log(object):
+    """Log channel for a single module.
+
+    log = logs.get('alarm')
+    log.debug('Set {} to {:0.2f}', pin, duty)  # only formatted if enabled
+
+    """
+
+    def __init__(self, module, book):
+        """Initializer."""
+        self.module = module
+        self.book = book
+
+    def enabled(self, level=DEBUG):
+        """Check if a level is enabled, to skip building expensive messages."""
+        return self.book.enabled(self.module, level)
+
+    def debug(self, fmt, *args):
+        """Log a debug message."""
+        self.book.log(self.module, DEBUG, fmt, args)
+
+    def info(self, fmt, *args):
+        """Log an info message."""
+        self.book.log(self.module, INFO, fmt, args)
+
+    def warning(self, fmt, *args):
+        """Log a warning."""
+        self.book.log(self.module, WARNING, fmt, args)
+
+    def error(self, fmt, *args):
+        """Log an error."""
+        self.book.log(self.module, ERROR, fmt, args)
+
+
+book = LogBook()
+atexit.register(book.flush)
+_channels = {}
+
+
+def get(module):
+    """Get the log channel for a module."""
+    try:
+        return _channels[module]
+    except KeyError:
+        return _channels.setdefault(module, Log(module, book))
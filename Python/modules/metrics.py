@@ -0,0 +1,136 @@
+"""Counters and latency histograms for the hot paths.
+
+Cheap enough to leave on in production, then read with the `[metrics]`
+command (a single JSON line):
+
+    _writes = metrics.counter('pwm.writes')
+    _latency = metrics.histogram('pwm.fifo_write')
+
+    _writes.inc()
+    _latency.observe(elapsed)  # in seconds
+
+"""
+
+import bisect
+import json
+import threading
+from array import array
+
+# Histogram bucket upper bounds, in seconds (10us to ~10s)
+BOUNDS = [1e-5 * 2 ** idx for idx in range(21)]
+
+
+class Counter(object):
+    """Number of times something happened."""
+
+    def __init__(self):
+        """Initializer."""
+        self.value = 0
+
+    def inc(self, amount=1):
+        """Increment the counter."""
+        self.value += amount
+
+    def snapshot(self):
+        """Return the current value."""
+        return self.value
+
+
+class Gauge(object):
+    """Value read from a callable when the metrics are collected."""
+
+    def __init__(self, func):
+        """Initializer."""
+        self.func = func
+
+    def snapshot(self):
+        """Return the current value."""
+        try:
+            return self.func()
+        except Exception as err:  # noqa
+            return str(err)
+
+
+class Histogram(object):
+    """Distribution of durations in power of two buckets."""
+
+    def __init__(self, bounds=BOUNDS):
+        """Initializer."""
+        self.bounds = bounds
+        self.counts = array('L', [0] * (len(bounds) + 1))
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        """Add a duration."""
+        with self._lock:
+            self.counts[bisect.bisect_left(self.bounds, seconds)] += 1
+            self.count += 1
+            self.total += seconds
+            if seconds > self.max:
+                self.max = seconds
+
+    def percentile(self, fraction):
+        """Return the upper bound of the bucket holding a percentile."""
+        rank = fraction * self.count
+        seen = 0
+        for idx, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                return min(self.bounds[idx], self.max) if idx < len(self.bounds) else self.max
+        return 0.0
+
+    def snapshot(self):
+        """Summarize the distribution in milliseconds."""
+        with self._lock:
+            if not self.count:
+                return {'count': 0}
+            return {
+                'count': self.count,
+                'mean_ms': round(self.total / self.count * 1000, 3),
+                'p50_ms': round(self.percentile(0.5) * 1000, 3),
+                'p95_ms': round(self.percentile(0.95) * 1000, 3),
+                'p99_ms': round(self.percentile(0.99) * 1000, 3),
+                'max_ms': round(self.max * 1000, 3),
+            }
+
+
+_metrics = {}
+_lock = threading.Lock()
+
+
+def _get(name, kind, *args):
+    """Return the metric with that name, created on first use."""
+    try:
+        return _metrics[name]
+    except KeyError:
+        with _lock:
+            return _metrics.setdefault(name, kind(*args))
+
+
+def counter(name):
+    """Get a Counter."""
+    return _get(name, Counter)
+
+
+def histogram(name):
+    """Get a Histogram."""
+    return _get(name, Histogram)
+
+
+def gauge(name, func):
+    """Register a Gauge (replaces any previous one)."""
+    _metrics[name] = Gauge(func)
+    return _metrics[name]
+
+
+def snapshot():
+    """Collect every metric ({name: value})."""
+    return dict((name, metric.snapshot()) for name, metric in _metrics.items())
+
+
+def to_json():
+    """Collect every metric as a single JSON line."""
+    return json.dumps(snapshot(), sort_keys=True, separators=(',', ':'))
@@ -0,0 +1,111 @@
+"""Send IFTTT notifications from a background thread."""
+
+import atexit
+import Queue
+import threading
+
+import config as cg
+import requests
+
+
+class Notifier(object):
+    """Post IFTTT Maker events without blocking the caller.
+
+    Events go through a bounded queue to a single worker that reuses one
+    pooled `requests.Session`. Failed posts are retried with exponential
+    backoff and an event already waiting in the queue is not queued twice.
+    Set `base_url` to a local HTTP server to test without the internet.
+
+    """
+
+    def __init__(self, base_url='https://maker.ifttt.com', maxsize=32,
+                 timeout=5.0, retries=4, backoff=1.0):
+        """Initializer."""
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        self._key = None
+        self._queue = Queue.Queue(maxsize)
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._stop_event = cg.PipeEvent()
+        self._session = requests.Session()
+        self._thread = cg.thread(self._run)
+
+    def key(self):
+        """Read the IFTTT key from secret.ini once."""
+        if self._key is None:
+            self._key = cg.read_ini('IFTTT', 'key', filename='secret')
+        return self._key
+
+    def notify(self, event, dataset=None):
+        """Queue an event and return False if it was coalesced or dropped."""
+        dataset = dataset or {'value1': ''}
+        item = (event, tuple(sorted(dataset.items())))
+        with self._lock:
+            if item in self._pending:
+                return False
+            try:
+                self._queue.put_nowait(item)
+            except Queue.Full:
+                self.dropped += 1
+                cg.send('IFTTT queue full, dropped: {}'.format(event))
+                return False
+            self._pending.add(item)
+        return True
+
+    def join(self, timeout=None):
+        """Wait until the queue is empty (or timeout) and return True if so."""
+        done = threading.Event()
+
+        def wait():
+            self._queue.join()
+            done.set()
+        cg.thread(wait)
+        return done.wait(timeout)
+
+    def stop(self):
+        """Stop retrying and end the worker thread."""
+        self._stop_event.set()
+        self._queue.put(None)
+
+    def _post(self, event, dataset):
+        """Post one event, retrying with exponential backoff."""
+        for attempt in range(self.retries + 1):
+            try:
+                url = '{}/trigger/{}/with/key/{}'.format(self.base_url, event, self.key())
+                response = self._session.post(url, data=dataset, timeout=self.timeout)
+                if response.status_code < 500:
+                    return True
+                err = 'HTTP {}'.format(response.status_code)
+            except Exception as exc:  # noqa
+                err = exc
+            cg.send('IFTTT attempt #{} failed ({}): {}'.format(attempt + 1, event, err))
+            if attempt < self.retries and self._stop_event.wait(self.backoff * 2 ** attempt):
+                break
+        return False
+
+    def _run(self):
+        """Worker thread loop."""
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                if self._post(item[0], dict(item[1])):
+                    self.sent += 1
+                else:
+                    self.failed += 1
+                    cg.send('IFTTT Failed - possible loss of INTERNET connection')
+            finally:
+                with self._lock:
+                    self._pending.discard(item)
+                self._queue.task_done()
+
+
+notifier = Notifier()
+atexit.register(notifier.join, 2.0)
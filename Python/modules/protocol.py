@@ -0,0 +1,64 @@
+"""Parse commands sent by the parent application.
+
+[`cmd`] @>`key`:>>`value` @>`key`:>>`value` ...etc
+
+"""
+
+import re
+import timeit
+
+_OPERATION = re.compile(r'\[([^\]]*)\]')
+_NUMBER = re.compile(r'[-+]?(?:(\d+)|\d*\.\d+(?:[eE][-+]?\d+)?|\d+\.\d*(?:[eE][-+]?\d+)?)\Z')
+_CONSTANTS = {'True': True, 'False': False, 'None': None,
+              'true': True, 'false': False}
+
+ARG_SEP = '@>'
+VALUE_SEP = ':>>'
+NO_VALUE = 'N/A'
+
+
+def coerce(raw):
+    """Convert a string to a bool, None, int or float without `eval()`."""
+    raw = raw.strip()
+    try:
+        return _CONSTANTS[raw]
+    except KeyError:
+        pass
+    match = _NUMBER.match(raw)
+    if match:
+        return int(raw) if match.group(1) else float(raw)
+    return raw
+
+
+def parse(message):
+    """Return the operation and a dictionary of arguments from a command.
+
+    Raises a ValueError if the message has no `[operation]`.
+
+    """
+    chunks = message.split(ARG_SEP)
+    match = _OPERATION.search(chunks[0])
+    if not match:
+        raise ValueError('Argument passed does not have proper format: {}'.format(message))
+    args = {}
+    for chunk in chunks[1:]:
+        key, sep, value = chunk.partition(VALUE_SEP)
+        args[coerce(key)] = coerce(value) if sep else NO_VALUE
+    return match.group(1), args
+
+
+def benchmark(count=100000):
+    """Time parsing a mix of typical commands (returns commands per second)."""
+    commands = ['[all_off]',
+                '[lcd] @>display:>>on',
+                '[clock] @>display:>>0.5',
+                '[status] @>arg:>>enter',
+                "[lcd] @>message:>>['Mon 7:30', 'Sunny 42F'] @>delay:>>1"]
+    number = count // len(commands)
+    elapsed = timeit.timeit(lambda: [parse(cmd) for cmd in commands], number=number)
+    return number * len(commands) / elapsed
+
+
+if __name__ == '__main__':
+    print parse("[lcd] @>message:>>['Mon 7:30', 'Sunny 42F'] @>delay:>>1 @>start")
+    print '{:,.0f} commands/sec'.format(benchmark())
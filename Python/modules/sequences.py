@@ -0,0 +1,244 @@
+"""Alarm sequences loaded from `sequences.json`.
+
+Each named sequence is validated and compiled when the file is loaded
+(stage PWM values and effect timelines), so nothing is parsed while an
+alarm runs. The file is reloaded when modified, without a restart.
+
+"""
+
+import json
+import os
+import threading
+
+import config as cg
+import effects
+import zones
+
+# Pin names that can be used in sequences.json (or a pin number, ex: "17").
+# The colors are logical channels that drive every RGB zone (see zones.py)
+PINS = {
+    'buzzer': ('Haptics', 'pin_buzzer'),
+    'shaker': ('Haptics', 'pin_shaker'),
+    'red': zones.CHANNELS['red'],
+    'green': zones.CHANNELS['green'],
+    'blue': zones.CHANNELS['blue'],
+}
+
+step_size = 0.2
+
+
+def resolve_pin(name):
+    """Convert a pin name (or a GPIO number, as an int or a string) to the pin number."""
+    if isinstance(name, basestring) and name.isdigit():
+        name = int(name)  # JSON object keys are always strings
+    if isinstance(name, int) and not isinstance(name, bool):
+        if not 0 <= name < 32:
+            raise ValueError('Unknown pin: `{}` (GPIO pins are 0-31)'.format(name))
+        return name
+    try:
+        pin = PINS[name]
+    except (KeyError, TypeError):
+        raise ValueError('Unknown pin: `{}` (known: {})'.format(name, sorted(PINS)))
+    return pin if isinstance(pin, int) else cg.get_pin(*pin)
+
+
+def _duty(value, where):
+    """Validate a duty cycle."""
+    if not isinstance(value, (int, float)) or not 0 <= value <= 1:
+        raise ValueError('{}: duty must be in [0, 1], not {}'.format(where, value))
+    return float(value)
+
+
+#
+# Effects
+#
+
+
+def compile_beep(duration, pin='buzzer', duty=0.2, period=2):
+    """Cycle the buzzer on for the first half of each period."""
+    pin = resolve_pin(pin)
+    duty = _duty(duty, 'beep')
+    if isinstance(period, bool) or not isinstance(period, (int, float)) or period <= 0:
+        raise ValueError('beep: `period` must be a number > 0, not {}'.format(period))
+    half = period / 2.0
+
+    def beep(counter):
+        return {pin: duty if counter % period <= half else 0.0}
+    return effects.sample(beep, duration, step_size, start=1)
+
+
+def compile_fade_led_strip(duration, max_brightness=0.6,
+                           order=('green', 'red', 'blue', 'green', 'red', 'blue')):
+    """Cycle the LED Strip through various colors."""
+    fade_stages = [resolve_pin(pin) for pin in order]
+    max_brightness = _duty(max_brightness, 'fade_led_strip')
+    if duration < len(fade_stages):
+        raise ValueError('a_s_t({}) not > len({})'.format(duration, len(fade_stages)))
+    time_total = int(duration) // len(fade_stages)
+    all_pins = sorted(set(fade_stages))
+    state = {'fade_stage': 0}
+
+    def fade_led_strip(counter):
+        fade_stage = state['fade_stage']
+        time_step = (counter % time_total) + 1.0
+        # Increment the LED value, then decrement on the next pin
+        value = 1 - (1 / time_step) if fade_stage % 2 == 0 else 1 / time_step
+        if fade_stage < len(fade_stages):
+            if time_step == time_total:
+                state['fade_stage'] += 1
+            return {fade_stages[fade_stage]: max_brightness * value}
+        return dict.fromkeys(all_pins, max_brightness)
+    return effects.sample(fade_led_strip, duration, step_size, start=1)
+
+
+EFFECTS = {
+    'beep': compile_beep,
+    'fade_led_strip': compile_fade_led_strip,
+}
+
+
+#
+# Compiled sequences
+#
+
+
+class Stage(object):
+    """Single compiled alarm stage."""
+
+    def __init__(self, name, duration, pwm, timeline, repeat=1, pause=0):
+        """Initializer."""
+        self.name = name
+        self.duration = duration
+        self.pwm = pwm  # {pin: duty} set at the start of the stage (all zones)
+        self.timeline = timeline  # effects.Timeline or None
+        self.repeat = repeat
+        self.pause = pause
+
+
+class Sequence(object):
+    """Compiled alarm sequence."""
+
+    def __init__(self, name, delay, stages):
+        """Initializer."""
+        self.name = name
+        self.delay = delay
+        self.stages = stages
+
+
+def _number(raw, key, where, default=None, kind=float):
+    """Validate a non-negative number (or integer, for kind=int)."""
+    value = raw.get(key, default)
+    if value is None or isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0:
+        raise ValueError('{}: `{}` must be a number >= 0, not {}'.format(where, key, value))
+    if kind is int and value != int(value):
+        raise ValueError('{}: `{}` must be an integer, not {}'.format(where, key, value))
+    return kind(value)
+
+
+def _object(raw, key, where):
+    """Validate an optional JSON object."""
+    value = raw.get(key) or {}
+    if not isinstance(value, dict):
+        raise ValueError('{}: `{}` must be an object, not {}'.format(where, key, value))
+    return value
+
+
+def compile_stage(raw, where):
+    """Validate and compile a single stage."""
+    if not isinstance(raw, dict):
+        raise ValueError('{}: must be an object'.format(where))
+    duration = _number(raw, 'duration', where)
+    pwm = dict((resolve_pin(pin), _duty(duty, '{} pwm.{}'.format(where, pin)))
+               for pin, duty in _object(raw, 'pwm', where).items())
+    pwm = zones.strips().expand(pwm)
+    timeline = None
+    params = dict(_object(raw, 'effect', where))
+    if params:
+        kind = params.pop('type', None)
+        if not isinstance(kind, basestring) or kind not in EFFECTS:
+            raise ValueError('{}: unknown effect `{}` (known: {})'.format(where, kind, sorted(EFFECTS)))
+        try:
+            timeline = EFFECTS[kind](duration, **params)
+        except TypeError as err:
+            raise ValueError('{}: invalid effect parameters ({})'.format(where, err))
+    repeat = _number(raw, 'repeat', where, default=1, kind=int)
+    if repeat < 1:
+        raise ValueError('{}: `repeat` must be >= 1'.format(where))
+    return Stage(raw.get('name', where), duration, pwm, timeline,
+                 repeat, _number(raw, 'pause', where, default=0))
+
+
+def compile_sequence(name, raw):
+    """Validate and compile a sequence (raises a ValueError if invalid)."""
+    if not isinstance(raw, dict) or not raw.get('stages'):
+        raise ValueError('Sequence `{}` must have a list of `stages`'.format(name))
+    stages = [compile_stage(stage, '{}.stages[{}]'.format(name, idx))
+              for idx, stage in enumerate(raw['stages'])]
+    return Sequence(name, _number(raw, 'delay', name, default=0), stages)
+
+
+class SequenceLibrary(object):
+    """Named sequences, reloaded only when the file is modified."""
+
+    def __init__(self, path=None):
+        """Initializer."""
+        self.path = path or cg._ini_path('sequences', ext='json')
+        self.sequences = {}
+        self.error = None  # why the current version of the file is invalid
+        self._version = None
+        self._lock = threading.Lock()
+
+    def reload(self, force=False):
+        """Load and compile the file if it changed.
+
+        An invalid file raises a ValueError and keeps the last valid sequences.
+        The error is only raised once for each version of the file.
+
+        """
+        stat = os.stat(self.path)
+        version = (stat.st_mtime, stat.st_size)
+        with self._lock:
+            if version == self._version and not force:
+                return False
+            self._version = version  # don't parse an invalid file again
+            try:
+                with open(self.path) as data_file:
+                    raw = json.load(data_file)
+                if not isinstance(raw, dict):
+                    raise ValueError('{} must contain an object'.format(self.path))
+                compiled = dict((name, compile_sequence(name, seq)) for name, seq in raw.items())
+            except (ValueError, EnvironmentError) as err:
+                self.error = err
+                raise
+            except Exception as err:  # noqa
+                # Missed by the validation, but still keep the last valid sequences
+                self.error = ValueError('{}: {}'.format(self.path, err))
+                raise self.error
+            self.sequences = compiled
+            self.error = None
+        cg.send('Loaded alarm sequences: {}'.format(sorted(compiled)))
+        return True
+
+    def _refresh(self):
+        """Reload the file if modified, else use the last valid sequences."""
+        try:
+            self.reload()
+        except (ValueError, EnvironmentError) as err:
+            if not self.sequences:
+                raise
+            cg.send('Error: Using the last valid alarm sequences ({})'.format(err), force=True)
+        if not self.sequences and self.error:
+            raise self.error  # the file was never valid
+
+    def get(self, name='default'):
+        """Return a compiled sequence (KeyError if unknown)."""
+        self._refresh()
+        return self.sequences[name]
+
+    def names(self):
+        """List the sequence names."""
+        self._refresh()
+        return sorted(self.sequences)
+
+
+library = SequenceLibrary()
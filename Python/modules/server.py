@@ -0,0 +1,101 @@
+"""Answer requests from other processes over a Unix domain socket.
+
+The protocol is JSON lines, one reply per request:
+
+    -> {"id": 1, "op": "presence", "args": {}}
+    <- {"id": 1, "ok": true, "result": "Present"}
+
+Only commands registered as `readonly` are served, and the privileged ops
+in `PRIVILEGED` (ex: for bootPiBlaster.py to restore the PWM pins).
+
+"""
+
+import json
+import os
+import socket
+import SocketServer
+
+import commands
+import config as cg
+
+SOCKET_PATH = '/tmp/pialarm.sock'
+# Ops with side effects that other local processes may request
+PRIVILEGED = frozenset(['pwm_resync'])
+
+
+class RequestHandler(SocketServer.StreamRequestHandler):
+    """Serve the JSON line requests of a single client connection."""
+
+    def handle(self):
+        """Loop until the client disconnects."""
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            if line.strip():
+                self.wfile.write(json.dumps(self.reply(line)) + '\n')
+                self.wfile.flush()
+
+    def reply(self, line):
+        """Run a single request and build the reply."""
+        reply = {'id': None, 'ok': False}
+        try:
+            request = json.loads(line)
+            reply['id'] = request.get('id')
+            command = commands.lookup(str(request.get('op', '')))
+            if not command or not (command.readonly or command.name in PRIVILEGED):
+                reply['error'] = 'Unknown or not allowed op: {}'.format(request.get('op'))
+            else:
+                reply['result'] = command(request.get('args'), self.server.context)
+                reply['ok'] = True
+        except Exception as err:  # noqa
+            reply['error'] = str(err)
+        return reply
+
+
+class CommandServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    """Threaded Unix socket server, so clients don't wait on each other."""
+
+    daemon_threads = True
+
+    def __init__(self, path=SOCKET_PATH, context=None):
+        """Initializer."""
+        self.context = context
+        self.path = path
+        # Remove the socket left by a previous instance
+        if os.path.exists(path):
+            os.remove(path)
+        SocketServer.UnixStreamServer.__init__(self, path, RequestHandler)
+        os.chmod(path, 0o666)
+
+    def server_close(self):
+        """Close the server and remove the socket file."""
+        SocketServer.UnixStreamServer.server_close(self)
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def serve(path=SOCKET_PATH, context=None):
+    """Start the server in a background thread."""
+    server = CommandServer(path, context)
+    cg.thread(server.serve_forever)
+    cg.send('Serving requests on: {}'.format(path))
+    return server
+
+
+def request(op, args=None, path=SOCKET_PATH, timeout=1.0):
+    """Send a single request (ex: from a short-lived script) and return the reply."""
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.settimeout(timeout)
+    try:
+        client.connect(path)
+        client.sendall(json.dumps({'id': 0, 'op': op, 'args': args or {}}) + '\n')
+        return json.loads(client.makefile().readline())
+    finally:
+        client.close()
+
+
+@commands.register('ping', readonly=True)
+def on_ping(args, context):
+    """Check that the server is alive."""
+    return 'pong'
@@ -0,0 +1,366 @@
+"""Simulated Raspberry Pi hardware that records what the code does.
+
+Stands in for `RPi.GPIO`, `Adafruit_CharLCD`, the MCP23008 and the
+Pi-Blaster FIFO (see context.py), so the modules run on any machine. Every
+pin transition, PWM duty and LCD frame is added to a fixed-size event log:
+
+    PIALARM_SIMULATE=1 python main.py
+
+    import simulator
+    mark = simulator.log.mark()
+    ...
+    for time, kind, pin, value, text in simulator.log.events('pwm', since=mark):
+        print time, pin, value
+
+"""
+
+import threading
+from array import array
+
+import config as cg
+
+# Event kinds
+KINDS = ('setup', 'output', 'input', 'edge', 'pwm', 'release', 'lcd')
+SETUP, OUTPUT, INPUT, EDGE, PWM, RELEASE, LCD_FRAME = range(len(KINDS))
+
+# Offset of the MCP23008 pins in the event log
+MCP_PIN = 100
+
+
+class EventLog(object):
+    """Ring buffer of (time, kind, pin, value) events stored in arrays.
+
+    Only the LCD frames keep a string (`texts`, by slot). Once full, the
+    oldest events are overwritten.
+
+    """
+
+    def __init__(self, size=1 << 16, clock=None):
+        """Initializer."""
+        self.size = size
+        self.clock = clock or cg.monotonic
+        self.times = array('d', [0.0]) * size
+        self.kinds = array('B', [0]) * size
+        self.pins = array('h', [0]) * size
+        self.values = array('d', [0.0]) * size
+        self.texts = {}
+        self.count = 0  # total number of events recorded
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        """Return the number of events kept."""
+        return min(self.count, self.size)
+
+    def record(self, kind, pin=-1, value=0.0, text=None):
+        """Add an event."""
+        with self._lock:
+            slot = self.count % self.size
+            self.times[slot] = self.clock()
+            self.kinds[slot] = kind
+            self.pins[slot] = pin
+            self.values[slot] = value
+            if text is not None:
+                self.texts[slot] = text
+            elif slot in self.texts:
+                del self.texts[slot]
+            self.count += 1
+
+    def mark(self):
+        """Return a position to only read the events recorded after it."""
+        return self.count
+
+    def events(self, kind=None, since=0):
+        """Yield (time, kind, pin, value, text), oldest first."""
+        kind = KINDS.index(kind) if isinstance(kind, str) else kind
+        with self._lock:
+            end = self.count
+            start = max(since, end - self.size)
+        for idx in range(start, end):
+            slot = idx % self.size
+            if kind is None or self.kinds[slot] == kind:
+                yield (self.times[slot], KINDS[self.kinds[slot]], self.pins[slot],
+                       self.values[slot], self.texts.get(slot))
+
+    def summary(self, since=0):
+        """Count the events of each kind."""
+        counts = dict.fromkeys(KINDS, 0)
+        for event in self.events(since=since):
+            counts[event[1]] += 1
+        return counts
+
+    def clear(self):
+        """Forget all events."""
+        with self._lock:
+            self.count = 0
+            self.texts.clear()
+
+
+log = EventLog()
+
+
+#
+# RPi.GPIO
+#
+
+
+class GPIO(object):
+    """Same interface as the `RPi.GPIO` module.
+
+    Outputs are recorded on transitions only. Inputs read LOW until set with
+    `drive()`, which also runs the edge detection callbacks (synchronously).
+
+    """
+
+    BCM = 11
+    BOARD = 10
+    OUT = 0
+    IN = 1
+    LOW = 0
+    HIGH = 1
+    PUD_OFF = 20
+    PUD_DOWN = 21
+    PUD_UP = 22
+    RISING = 31
+    FALLING = 32
+    BOTH = 33
+
+    def __init__(self, event_log=None):
+        """Initializer."""
+        self.log = event_log or log
+        self.mode = None
+        self.directions = {}
+        self.outputs = {}
+        self.inputs = {}
+        self.callbacks = {}  # {pin: (edge, [callback])}
+
+    def setwarnings(self, flag):
+        """Ignored."""
+
+    def setmode(self, mode):
+        """Set the pin numbering."""
+        self.mode = mode
+
+    def setup(self, pin, direction, pull_up_down=PUD_OFF, initial=None):
+        """Set a pin as an input or an output."""
+        self.directions[pin] = direction
+        self.log.record(SETUP, pin, direction)
+        if direction == self.IN and pull_up_down == self.PUD_UP:
+            self.inputs.setdefault(pin, self.HIGH)
+        elif direction == self.OUT and initial is not None:
+            self.output(pin, initial)
+
+    def output(self, pin, value):
+        """Set the level of an output."""
+        value = self.HIGH if value else self.LOW
+        if self.outputs.get(pin) != value:
+            self.outputs[pin] = value
+            self.log.record(OUTPUT, pin, value)
+
+    def input(self, pin):
+        """Read the level of a pin."""
+        if self.directions.get(pin) == self.OUT:
+            return self.outputs.get(pin, self.LOW)
+        return self.inputs.get(pin, self.LOW)
+
+    def add_event_detect(self, pin, edge, callback=None, bouncetime=None):
+        """Watch an input for edges."""
+        self.callbacks[pin] = (edge, [callback] if callback else [])
+
+    def add_event_callback(self, pin, callback):
+        """Add a callback to a watched input."""
+        self.callbacks[pin][1].append(callback)
+
+    def remove_event_detect(self, pin):
+        """Stop watching an input."""
+        self.callbacks.pop(pin, None)
+
+    def cleanup(self, pin=None):
+        """Reset the pins."""
+        pins = [pin] if pin is not None else list(self.directions)
+        for pin in pins:
+            self.directions.pop(pin, None)
+            self.outputs.pop(pin, None)
+            self.callbacks.pop(pin, None)
+
+    #
+    # Simulation controls
+    #
+
+    def drive(self, pin, level):
+        """Set the level of an input (ex: a button) and run its callbacks."""
+        level = self.HIGH if level else self.LOW
+        last = self.inputs.get(pin, self.LOW)
+        self.inputs[pin] = level
+        self.log.record(INPUT, pin, level)
+        if level == last or pin not in self.callbacks:
+            return
+        edge, callbacks = self.callbacks[pin]
+        if edge == self.BOTH or edge == (self.RISING if level else self.FALLING):
+            self.log.record(EDGE, pin, level)
+            for callback in callbacks:
+                callback(pin)
+
+    def press(self, pin):
+        """Press and release a button."""
+        self.drive(pin, self.HIGH)
+        self.drive(pin, self.LOW)
+
+
+gpio = GPIO()
+
+
+#
+# Adafruit_CharLCD and MCP23008
+#
+
+
+class Adafruit_CharLCD(object):
+    """HD44780 character LCD that records each frame.
+
+    Text is written to the display RAM like the real controller, so the
+    lines of a 20x4 display wrap in the order 1, 3, 2, 4.
+
+    """
+
+    ROW_OFFSETS = (0x00, 0x40, 0x14, 0x54)
+
+    def __init__(self, rs, en, d4, d5, d6, d7, cols, lines, backlight=None,
+                 invert_polarity=True, enable_pwm=False, gpio=None, event_log=None, **kwargs):
+        """Initializer."""
+        self.cols = cols
+        self.lines = lines
+        self.log = event_log or log
+        self.backlight = 1.0
+        self._ram = [' '] * 0x80
+        self._address = 0
+
+    def frame(self):
+        """Return the displayed text (one line per row)."""
+        return '\n'.join(''.join(self._ram[offset:offset + self.cols])
+                         for offset in self.ROW_OFFSETS[:self.lines])
+
+    def _record(self):
+        """Add the current frame to the event log."""
+        self.log.record(LCD_FRAME, value=self.backlight, text=self.frame())
+
+    def clear(self):
+        """Clear the display."""
+        self._ram = [' '] * 0x80
+        self._address = 0
+        self._record()
+
+    def home(self):
+        """Move the cursor to the first character."""
+        self._address = 0
+
+    def set_cursor(self, col, row):
+        """Move the cursor."""
+        self._address = self.ROW_OFFSETS[min(row, self.lines - 1)] + col
+
+    def message(self, text):
+        """Write text at the cursor (a newline moves to the next row)."""
+        row = 0
+        for char in text:
+            if char == '\n':
+                row += 1
+                self.set_cursor(0, row)
+                continue
+            self._ram[self._address] = char
+            # The display RAM of each pair of lines is 40 characters long
+            self._address += 1
+            if self._address == 0x28:
+                self._address = 0x40
+            elif self._address == 0x68:
+                self._address = 0
+        self._record()
+
+    def set_backlight(self, backlight):
+        """Set the backlight level."""
+        self.backlight = float(backlight)
+
+    def enable_display(self, enable):
+        """Ignored."""
+
+    def show_cursor(self, show):
+        """Ignored."""
+
+    def blink(self, blink):
+        """Ignored."""
+
+
+class MCP23008(object):
+    """I2C GPIO expander (recorded with the pin numbers offset by MCP_PIN)."""
+
+    def __init__(self, address=0x20, busnum=None, i2c=None, event_log=None, **kwargs):
+        """Initializer."""
+        self.address = address
+        self.log = event_log or log
+        self.outputs = {}
+
+    def setup(self, pin, value):
+        """Set a pin as an input or an output."""
+        self.log.record(SETUP, MCP_PIN + pin, value)
+
+    def output(self, pin, value):
+        """Set the level of an output."""
+        self.output_pins({pin: value})
+
+    def output_pins(self, pins):
+        """Set the level of several outputs."""
+        for pin, value in sorted(pins.items()):
+            value = 1 if value else 0
+            if self.outputs.get(pin) != value:
+                self.outputs[pin] = value
+                self.log.record(OUTPUT, MCP_PIN + pin, value)
+
+    def input(self, pin):
+        """Read the level of a pin."""
+        return self.outputs.get(pin, 0)
+
+
+#
+# Pi-Blaster
+#
+
+
+class Blaster(object):
+    """Same interface as `blaster.PiBlaster`, recording the PWM commands."""
+
+    device = 'simulator'
+
+    def __init__(self, event_log=None):
+        """Initializer."""
+        self.log = event_log or log
+
+    def write(self, lines):
+        """Parse and record a list of Pi-Blaster commands."""
+        for line in lines:
+            if line.startswith('release'):
+                self.log.record(RELEASE, int(line.split()[1]))
+            else:
+                pin, duty = line.split('=')
+                self.log.record(PWM, int(pin), float(duty))
+        return sum(len(line) + 1 for line in lines)
+
+    def set_pwm(self, pin_num, percent):
+        """Set the duty cycle of a single pin."""
+        return self.set_pwm_many({pin_num: percent})
+
+    def set_pwm_many(self, duties):
+        """Set the duty cycle of several pins ({pin: percent}) at once."""
+        for pin in sorted(duties):
+            self.log.record(PWM, int(pin), round(float(duties[pin]), 2))
+        return len(duties)
+
+    def release(self, pin_num):
+        """Release pin from Pi-Blaster."""
+        self.log.record(RELEASE, int(pin_num))
+        return 1
+
+    def close(self):
+        """Nothing to close."""
+
+
+def install():
+    """Send the PWM commands to the simulator."""
+    cg.use_pwm_device(Blaster())
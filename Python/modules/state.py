@@ -0,0 +1,57 @@
+"""In-memory store for the user's Home/Away status."""
+
+import atexit
+import threading
+
+import config as cg
+
+
+class PresenceStore(object):
+    """Serve the Home/Away status from memory and persist it lazily.
+
+    Writes are debounced: a burst of enter/exit events only rewrites the
+    ini file once, after `delay` seconds (or at exit), via `cg.write_ini`.
+
+    """
+
+    def __init__(self, section='Alarm_Status', option='running', delay=0.5):
+        """Initializer."""
+        self.section = section
+        self.option = option
+        self.delay = delay
+        self._pending = None  # value waiting to be written
+        self._timer = None
+        self._lock = threading.Lock()
+        atexit.register(self.flush)
+
+    def get(self):
+        """Return True if the user is home."""
+        pending = self._pending
+        if pending is not None:
+            return pending
+        # Only re-parsed when another process (i.e. status.py) modified the file
+        return 'true' in cg.read_ini(self.section, self.option).lower()
+
+    def set(self, present):
+        """Update the status and schedule a write."""
+        with self._lock:
+            self._pending = bool(present)
+            if not self._timer:
+                self._timer = threading.Timer(self.delay, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self):
+        """Write any pending change to disk."""
+        with self._lock:
+            if self._timer:
+                self._timer.cancel()
+                self._timer = None
+            pending = self._pending
+            if pending is None:
+                return
+            cg.write_ini(self.section, self.option, 'true' if pending else 'false')
+            self._pending = None
+
+
+presence = PresenceStore()
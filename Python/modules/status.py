@@ -2,19 +2,20 @@
 
 import sys
 
+import commands
 import config as cg
+import state
 
 # FYI: For a synchronous status query, call this file with an arg of:
 #    exit, enter, false, or true respectively
 
 quiet = False
-cg.quiet_logging(quiet)
 
 
 def update_status(running):
     """Update status in INI file."""
     # cg.send('Setting alarm status to: {}'.format(running))
-    cg.write_ini('Alarm_Status', 'running', running)
+    state.presence.set('true' in str(running).lower())
 
 
 def set_led_state():
@@ -30,6 +31,7 @@ def set_led_state():
 
 def run(arg):
     """Parse arguments."""
+    arg = str(arg).lower()
     if 'exit' in arg or 'leave' in arg or 'false' in arg:
         update_status('false')
     elif 'enter' in arg or 'true' in arg:
@@ -39,6 +41,23 @@ def run(arg):
     set_led_state()
 
 
+@commands.register('presence', readonly=True)
+def on_presence(args, context):
+    """Return the Home/Away status, without updating the LED."""
+    return 'Present' if cg.check_status() else 'Away'
+
+
+@commands.register('status', schema={'arg': str})
+def on_status(args, context):
+    """Update the Home/Away status or only the LED."""
+    cg.send('<*> Starting status!')
+    arg = cg.dict_arg(args, 'arg')
+    if arg:
+        run(arg)
+    else:
+        set_led_state()
+
+
 if __name__ == '__main__':
     # Quiet logging, so the only output is "forced"
     cg.quiet_logging(True)
@@ -4,6 +4,7 @@ import os
 from time import sleep
 
 import all_off
+import commands
 import config as cg
 import fade
 import lcd
@@ -52,6 +53,14 @@ def t_hw():
     print 'Hey! This module is working!'
 
 
+@commands.register('test')
+def on_test(args, context):
+    """Run the tests that don't need an operator."""
+    cg.send('<*> Starting tests!')
+    t_hw()  # just hello world
+    # t_weather()  # *watch the 1 min. API limit
+
+
 def t_weather():
     """Output the commute-weather format."""
     print weather.commute(quiet=False)
@@ -1,10 +1,15 @@
 """Manipulate a TM1637 7-segment display."""
 
+import collections
 import math
 import threading
+import time
 from time import localtime, sleep
 
+import commands
 import config as cg
+import gpio
+import metrics
 from context import IO
 
 IO.setwarnings(False)
@@ -17,124 +22,317 @@ ADDR_AUTO = 0x40
 ADDR_FIXED = 0x44
 STARTADDR = 0xC0
 
+# How often the clock thread checks for wall clock jumps (ex: an NTP step)
+# while it waits for the next minute, and the jump (in seconds) that redraws
+DRIFT_CHECK = 10.0
+MAX_DRIFT = 1.0
+
+# Segment byte of each digit, without and with the double point
+BLANK = 0x7F
+SEGMENTS = [dict(enumerate(HexDigits)), dict((idx, seg | 0x80) for idx, seg in enumerate(HexDigits))]
+for _table in SEGMENTS:
+    _table[BLANK] = 0
+
+_ack_wait = metrics.histogram('tm1637.ack_wait')
+_frames = metrics.counter('tm1637.frames')
+_digits = metrics.counter('tm1637.digits')
+_unchanged = metrics.counter('tm1637.unchanged')
+_clock_wakeups = metrics.counter('tm1637.clock_wakeups')
+_clock_jumps = metrics.counter('tm1637.clock_jumps')
+_transaction = metrics.histogram('tm1637.transaction')
+_ack_errors = metrics.counter('tm1637.ack_errors')
+_failed = metrics.counter('tm1637.failed')
+_degraded_skips = metrics.counter('tm1637.degraded_skips')
+_coalesced = metrics.counter('tm1637.coalesced')
+
+
+class AckTimeout(IOError):
+    """The display did not acknowledge a byte."""
+
 
 class TM1637(object):
-    """TM1637 7-Segment Display."""
+    """TM1637 7-Segment Display.
+
+    The public methods queue the operation for a single display thread and
+    return a `cg.Future` without blocking (ex: `display.show(digits).result()`).
+
+    A byte that is not acknowledged within `ack_timeout` seconds fails the
+    transaction, which is retried `retries` times. After `fail_limit` failed
+    transactions in a row, writes are skipped for `backoff` seconds (doubled
+    each time, up to `max_backoff`), so a disconnected display costs nothing.
 
-    def __init__(self, clk, dio, brightness=1.0):
+    """
+
+    def __init__(self, clk, dio, brightness=1.0, ack_timeout=0.005, retries=2,
+                 fail_limit=3, backoff=1.0, max_backoff=60.0, bus=None):
         """Initializer."""
         self.CLK = clk
         self.DIO = dio
+        self.bus = bus or gpio.bus()  # see gpio.py
         self.brightness = brightness
+        self.ack_timeout = ack_timeout
+        self.retries = retries
+        self.fail_limit = fail_limit
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._failures = 0  # failed transactions in a row
+        self._degraded_until = None
 
         self.double_point = False
         self.current_values = [0, 0, 0, 0]
+        self._frame = None  # segment bytes on the display (None if unknown)
+        self._frame_brightness = None
+
+        self._queue = collections.deque()  # (key, [func, args, future])
+        self._pending = {}  # {key: queued entry} for the calls that coalesce
+        self._cond = threading.Condition()
+        self._owner = None
+        metrics.gauge('tm1637.queue_depth', lambda: len(self._queue))
+
+        self.bus.setup(self.CLK, IO.OUT)
+        self.bus.setup(self.DIO, IO.OUT)
+
+    #
+    # Commands, run in order by the display thread
+    #
+
+    def submit(self, func, args=(), key=None):
+        """Queue a call for the display thread and return a cg.Future.
+
+        Only the display thread drives the pins, so transactions from the
+        clock and from commands can't interleave. A call with a `key` updates
+        the arguments of a queued call with the same key instead (ex: only
+        the last of several brightness changes is sent).
+
+        """
+        with self._cond:
+            if key is not None and key in self._pending:
+                entry = self._pending[key]
+                entry[1] = args
+                _coalesced.inc()
+                return entry[2]
+            entry = [func, args, cg.Future()]
+            if key is not None:
+                self._pending[key] = entry
+            self._queue.append((key, entry))
+            if self._owner is None:
+                self._owner = cg.thread(self._run)
+            self._cond.notify()
+            return entry[2]
+
+    def _run(self):
+        """Display thread loop."""
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+                key, entry = self._queue.popleft()
+                if key is not None:
+                    del self._pending[key]
+                func, args, future = entry
+            try:
+                future.set_result(func(*args))
+            except Exception as err:  # noqa
+                cg.send('TM1637 {} failed: {}'.format(func.__name__, err))
+                future.set_exception(err)
+
+    def flush(self, timeout=None):
+        """Wait until the queued calls are done."""
+        return self.submit(lambda: None).result(timeout)
 
-        IO.setup(self.CLK, IO.OUT)
-        IO.setup(self.DIO, IO.OUT)
+    def show(self, data):
+        """Show data on display."""
+        return self.submit(self._show, (list(data),))
+
+    def set_digit(self, idx, data):
+        """Set 7-segment digit by index [0, 3]."""
+        assert not (idx < 0 or idx > 3), 'Index must be in (0,3). Args: ({},{})'.format(idx, data)
+        return self.submit(self._set_digit, (idx, data))
+
+    def set_brightness(self, percent):
+        """Set brightness in range 0-1."""
+        return self.submit(self._set_brightness, (percent,), key='brightness')
+
+    def show_colon(self, on):
+        """Show or hide double point divider."""
+        return self.submit(self._show_colon, (on,), key='colon')
+
+    def clear(self):
+        """Clear display."""
+        return self.submit(self._clear)
 
     def cleanup(self):
         """Stop updating clock, turn off display, and cleanup GPIO."""
         self.stop_clock()
         self.clear()
-        IO.cleanup()
+        return self.submit(self.bus.cleanup)
 
-    def clear(self):
-        """Clear display."""
+    #
+    # Display thread
+    #
+
+    def _clear(self):
+        """Turn off all the digits."""
         b = self.brightness
         point = self.double_point
         self.brightness = 0
         self.double_point = False
         data = [0x7F, 0x7F, 0x7F, 0x7F]
-        self.show(data)
+        self._show(data)
         # Restore previous settings:
         self.brightness = b
         self.double_point = point
 
-    def show(self, data):
-        """Show data on display."""
-        for i in range(0, 4):
-            self.current_values[i] = data[i]
+    def _show(self, data):
+        """Show four digits.
 
-        self.start()
-        self.write_byte(ADDR_AUTO)
-        self.br()
-        self.write_byte(STARTADDR)
-        for i in range(0, 4):
-            self.write_byte(self.coding(data[i]))
-        self.br()
-        self.write_byte(0x88 + int(self.brightness))
-        self.stop()
+        Only the digits that changed since the last frame are sent: nothing if
+        the frame is the same, a single digit write (4 bytes) if only one
+        changed, else the whole frame (7 bytes).
 
-    def set_digit(self, idx, data):
+        """
+        for i in range(0, 4):
+            self.current_values[i] = data[i]
+        frame = self.encode(data)
+
+        if self._frame is not None and self._frame_brightness == self.brightness:
+            changed = [idx for idx in range(4) if frame[idx] != self._frame[idx]]
+            if not changed:
+                _unchanged.inc()
+                return
+            if len(changed) == 1:
+                self._write_digit(changed[0], frame[changed[0]])
+                return
+        self._write_frame(frame)
+
+    def _set_digit(self, idx, data):
         """Set 7-segment digit by index [0, 3]."""
-        assert not (idx < 0 or idx > 3), 'Index must be in (0,3). Args: ({},{})'.format(idx, data)
-
         self.current_values[idx] = data
-
-        self.start()
-        self.write_byte(ADDR_FIXED)
-        self.br()
-        self.write_byte(STARTADDR | idx)
-        self.write_byte(self.coding(data))
-        self.br()
-        self.write_byte(0x88 + int(self.brightness))
-        self.stop()
-
-    def set_brightness(self, percent):
-        """Set brightness in range 0-1."""
+        segment = self.coding(data)
+        if (self._frame is not None and self._frame[idx] == segment and
+                self._frame_brightness == self.brightness):
+            _unchanged.inc()
+            return
+        self._write_digit(idx, segment)
+
+    def encode(self, data):
+        """Look up the segment bytes of four digits."""
+        table = SEGMENTS[self.double_point]
+        return [table[data[i]] for i in range(0, 4)]
+
+    def _transaction(self, send):
+        """Run a bus transaction with retries and return False if it failed."""
+        if self._degraded_until is not None and cg.monotonic() < self._degraded_until:
+            _degraded_skips.inc()
+            return False
+        start = cg.monotonic()
+        for attempt in range(self.retries + 1):
+            try:
+                send()
+                break
+            except AckTimeout:
+                _ack_errors.inc()
+                self.stop()  # release the bus before retrying
+        else:
+            _failed.inc()
+            _transaction.observe(cg.monotonic() - start)
+            self._failures += 1
+            if self._failures >= self.fail_limit:
+                backoff = min(self.backoff * 2 ** (self._failures - self.fail_limit),
+                              self.max_backoff)
+                self._degraded_until = cg.monotonic() + backoff
+                cg.send('TM1637 is not acknowledging, skipping writes for {}s'.format(backoff))
+            return False
+        _transaction.observe(cg.monotonic() - start)
+        if self._failures:
+            cg.send('TM1637 is acknowledging again')
+            self._failures = 0
+            self._degraded_until = None
+        return True
+
+    def _write_frame(self, frame):
+        """Send the segment bytes of all the digits."""
+        def send():
+            self.start()
+            self.write_byte(ADDR_AUTO)
+            self.br()
+            self.write_byte(STARTADDR)
+            for i in range(0, 4):
+                self.write_byte(frame[i])
+            self.br()
+            self.write_byte(0x88 + int(self.brightness))
+            self.stop()
+
+        _frames.inc()
+        if self._transaction(send):
+            self._frame = list(frame)
+            self._frame_brightness = self.brightness
+        else:
+            self._frame = None  # unknown, send everything next time
+
+    def _write_digit(self, idx, segment):
+        """Send the segment byte of a single digit."""
+        def send():
+            self.start()
+            self.write_byte(ADDR_FIXED)
+            self.br()
+            self.write_byte(STARTADDR | idx)
+            self.write_byte(segment)
+            self.br()
+            self.write_byte(0x88 + int(self.brightness))
+            self.stop()
+
+        _digits.inc()
+        if not self._transaction(send):
+            self._frame = None
+        elif self._frame is not None:
+            self._frame[idx] = segment
+            self._frame_brightness = self.brightness  # applies to every digit
+
+    def _set_brightness(self, percent):
+        """Change the brightness (0-1) and redraw."""
         max_brightness = 7.0
         brightness = math.ceil(max_brightness * percent)
         if (brightness < 0):
             brightness = 0
         if (self.brightness != brightness):
             self.brightness = brightness
-            self.show(self.current_values)
+            self._show(self.current_values)
 
-    def show_colon(self, on):
-        """Show or hide double point divider."""
+    def _show_colon(self, on):
+        """Show or hide the double point and redraw."""
         if (self.double_point != on):
             self.double_point = on
-            self.show(self.current_values)
+            self._show(self.current_values)
 
     def write_byte(self, data):
         """Write byte to display."""
-        for i in range(0, 8):
-            IO.output(self.CLK, IO.LOW)
-            if (data & 0x01):
-                IO.output(self.DIO, IO.HIGH)
-            else:
-                IO.output(self.DIO, IO.LOW)
-            data = data >> 1
-            IO.output(self.CLK, IO.HIGH)
-
-        # Wait for ACK
-        IO.output(self.CLK, IO.LOW)
-        IO.output(self.DIO, IO.HIGH)
-        IO.output(self.CLK, IO.HIGH)
-        IO.setup(self.DIO, IO.IN)
-
-        while IO.input(self.DIO):
-            sleep(0.001)
-            if (IO.input(self.DIO)):
-                IO.setup(self.DIO, IO.OUT)
-                IO.output(self.DIO, IO.LOW)
-                IO.setup(self.DIO, IO.IN)
-        IO.setup(self.DIO, IO.OUT)
+        self.bus.send_byte(self.CLK, self.DIO, data)
+
+        # The display pulls DIO low to acknowledge, poll for at most ack_timeout
+        start = cg.monotonic()
+        acked = not self.bus.input(self.DIO)
+        while not acked and cg.monotonic() - start < self.ack_timeout:
+            sleep(0.0001)
+            acked = not self.bus.input(self.DIO)
+        _ack_wait.observe(cg.monotonic() - start)
+        self.bus.setup(self.DIO, IO.OUT)
+        if not acked:
+            raise AckTimeout('No ACK from the TM1637 after {}s'.format(self.ack_timeout))
 
     def start(self):
         """Send start signal to TM1637."""
-        IO.output(self.CLK, IO.HIGH)
-        IO.output(self.DIO, IO.HIGH)
-        IO.output(self.DIO, IO.LOW)
-        IO.output(self.CLK, IO.LOW)
+        self.bus.output(self.CLK, IO.HIGH)
+        self.bus.output(self.DIO, IO.HIGH)
+        self.bus.output(self.DIO, IO.LOW)
+        self.bus.output(self.CLK, IO.LOW)
 
     def stop(self):
         """Stop clock."""
-        IO.output(self.CLK, IO.LOW)
-        IO.output(self.DIO, IO.LOW)
-        IO.output(self.CLK, IO.HIGH)
-        IO.output(self.DIO, IO.HIGH)
+        self.bus.output(self.CLK, IO.LOW)
+        self.bus.output(self.DIO, IO.LOW)
+        self.bus.output(self.CLK, IO.HIGH)
+        self.bus.output(self.DIO, IO.HIGH)
 
     def br(self):
         """Terse break."""
@@ -143,36 +341,55 @@ class TM1637(object):
 
     def coding(self, data):
         """Set coding of display."""
-        point_data = 0x80 if self.double_point else 0
-        return 0 if data == 0x7F else HexDigits[data] + point_data
+        return SEGMENTS[self.double_point][data]
+
+    def clock(self, military_time, blink=False):
+        """Clock thread script.
 
-    def clock(self, military_time):
-        """Clock thread script."""
+        Sleeps until the next minute (or second, to blink the double point)
+        instead of polling. The wait is timed with the monotonic clock and
+        compared with the wall clock every DRIFT_CHECK seconds, so after an
+        NTP step (or a DST change) the clock is redrawn within DRIFT_CHECK
+        seconds and the wait is aligned to the new time.
+
+        """
         # Based on: https://github.com/johnlr/raspberrypi-tm1637
         self.show_colon(True)
-        while (not self.__stop_event.is_set()):
-            t = localtime()
-            hour = t.tm_hour
-            if not military_time:
-                hour = 12 if (t.tm_hour % 12) == 0 else t.tm_hour % 12
-            d0 = hour // 10 if hour // 10 else 0
-            d1 = hour % 10
-            d2 = t.tm_min // 10
-            d3 = t.tm_min % 10
-            digits = [d0, d1, d2, d3]
-            self.show(digits)
-            # # Optional visual feedback of running alarm:
-            # print digits
-            # for i in tqdm(range(60 - t.tm_sec)):
-            for i in range(60 - t.tm_sec):
-                if (not self.__stop_event.is_set()):
-                    sleep(1)
-
-    def start_clock(self, military_time=True):
+        period = 1 if blink else 60
+        while not self.__stop_event.is_set():
+            wall = time.time()
+            mono = cg.monotonic()
+            t = localtime(wall)
+            if blink:
+                self.show_colon(t.tm_sec % 2 == 0)
+            self.show(self.clock_digits(t, military_time))
+
+            # Wake up just after the next boundary of the wall clock
+            deadline = mono + period - (t.tm_sec % period) - (wall % 1) + 0.01
+            while True:
+                if self.__stop_event.wait(min(deadline - cg.monotonic(), DRIFT_CHECK)):
+                    return
+                _clock_wakeups.inc()
+                drift = (time.time() - wall) - (cg.monotonic() - mono)
+                if abs(drift) > MAX_DRIFT:
+                    _clock_jumps.inc()
+                    cg.send('Wall clock jumped by {:+.1f}s, redrawing the clock'.format(drift))
+                    break
+                if cg.monotonic() >= deadline:
+                    break
+
+    @staticmethod
+    def clock_digits(t, military_time=True):
+        """Convert a time.struct_time to the four clock digits."""
+        hour = t.tm_hour
+        if not military_time:
+            hour = 12 if (t.tm_hour % 12) == 0 else t.tm_hour % 12
+        return [hour // 10, hour % 10, t.tm_min // 10, t.tm_min % 10]
+
+    def start_clock(self, military_time=True, blink=False):
         """Start clock thread."""
-        # Stop event based on: http://stackoverflow.com/a/6524542/3219667
-        self.__stop_event = threading.Event()
-        self.__clock_thread = threading.Thread(target=self.clock, args=(military_time,))
+        self.__stop_event = cg.PipeEvent()  # wakes up the thread immediately
+        self.__clock_thread = threading.Thread(target=self.clock, args=(military_time, blink))
         self.__clock_thread.daemon = True  # stops w/ main thread
         self.__clock_thread.start()
 
@@ -181,11 +398,21 @@ class TM1637(object):
         try:
             print 'Attempting to stop live clock'
             self.__stop_event.set()
+            # Let the thread queue its last show(), so clear() is queued after it
+            self.__clock_thread.join()
             self.clear()
         except AttributeError:
             print 'No clock to close'
 
 
+@commands.register('clock', schema={'display': float})
+def on_clock(args, context):
+    """Update the brightness of the clock display."""
+    cg.send('<*> Updating TM1637 Clock Module (brightness)!')
+    cg.send('**TM1637 Clock Args: {}'.format(args))
+    context.Display.set_brightness(args['display'])
+
+
 if __name__ == '__main__':
     """Confirm the display operation"""
 
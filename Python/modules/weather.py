@@ -4,11 +4,15 @@ import json
 import urllib2
 
 import config as cg
+import metrics
 import numpy as np
 
 # Based on: https://www.hackster.io/brad-buskey/getweather-for-omega2-8e3298
 
 
+_fetch_time = metrics.histogram('weather.fetch')
+
+
 class Wunderground(object):
     """Connect to Weather Underground API."""
 
@@ -25,24 +29,33 @@ class Wunderground(object):
 
     def fetch(self, req_type):
         """Request Weather Data."""
+        start = cg.monotonic()
         get_url = 'http://api.wunderground.com/api/{}/{}/q/{},{}.json'.format(
             self.apikey, req_type, self.lat, self.lon)
         weatherdict = urllib2.urlopen(get_url).read()
         weatherinfo = json.loads(weatherdict)
         # cg.send('\nComplete weatherinfo JSON:')
         # cg.send(weatherinfo)
+        _fetch_time.observe(cg.monotonic() - start)
         self.count += 1
         cg.send('New WU request, total: {}'.format(self.count))
         return weatherinfo
 
 
-# Initialize WU instance only once.
-WU = Wunderground()
+_WU = None
+
+
+def wu():
+    """Initialize WU instance only once (on first use)."""
+    global _WU
+    if _WU is None:
+        _WU = Wunderground()
+    return _WU
 
 
 def conditions():
     """Get the day's summary."""
-    weatherinfo = WU.fetch('conditions')
+    weatherinfo = wu().fetch('conditions')
     # For current conditions, everything is under current observation:
     weatherdata = weatherinfo['current_observation']
 
@@ -81,14 +94,14 @@ def conditions():
 
 def forecast():
     """Print forecast."""
-    weatherinfo = WU.fetch('forecast')
+    weatherinfo = wu().fetch('forecast')
     print weatherinfo
     print 'Error: forecast....isn\'t parsed yet'
 
 
 def commute(quiet=True):
     """Return summary of commute weather."""
-    weatherinfo = WU.fetch('hourly')
+    weatherinfo = wu().fetch('hourly')
     weatherdata = weatherinfo['hourly_forecast']
 
     # Determine the morning commute weather and for when I commute home
@@ -153,5 +166,5 @@ def commute(quiet=True):
 
 
 if __name__ == '__main__':
-    weatherinfo = WU.fetch('hourly')
+    weatherinfo = wu().fetch('hourly')
     print weatherinfo
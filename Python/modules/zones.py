@@ -0,0 +1,123 @@
+"""RGB LED strips (zones) driven as a single vectorized color frame.
+
+Zones are read from the `[RGB_Strip]` section of pins.ini: the first strip
+uses `pin_red`, `pin_green`, `pin_blue`, then strip N uses `pin_red_N`, etc.
+Pins set to 0 are not connected and are never written (a zone can use only
+some of the colors). An optional `gain` (`gain_N`) scales the
+brightness of a strip.
+
+Effects address the logical channels (`CHANNELS`) instead of pins, so one
+keyframe changes the color of every zone.
+
+numpy is only imported once a Zones object is created (by the effects), so
+`all_off` and `main.py` start without it.
+
+"""
+
+import config as cg
+
+COLORS = ('red', 'green', 'blue')
+# Pseudo pin numbers for the logical channels (GPIO pins are all < 32)
+CHANNEL_PIN = 200
+CHANNELS = dict((color, CHANNEL_PIN + idx) for idx, color in enumerate(COLORS))
+
+
+def is_channel(pin):
+    """Check if a pin number is a logical color channel."""
+    return pin >= CHANNEL_PIN
+
+
+class Zones(object):
+    """Pins and gains of the RGB strips as (zones x 3) arrays."""
+
+    def __init__(self, pins, gains=None):
+        """Initializer."""
+        import numpy as np
+        self.pins = np.array(pins, dtype=np.int64).reshape(-1, 3)
+        self.gains = np.ones(len(self.pins)) if gains is None else np.asarray(gains, dtype=float)
+        self.flat_pins = self.pins.ravel()
+        self.connected = self.flat_pins > 0
+
+    def __len__(self):
+        """Return the number of zones."""
+        return len(self.pins)
+
+    def render(self, rgb, resolution=100):
+        """Compute the quantized duty of every channel of every zone.
+
+        `rgb` is a single color (3,) or one color per zone (zones x 3).
+        Returns a flat array aligned with `flat_pins`.
+
+        """
+        import numpy as np
+        duties = np.clip(np.asarray(rgb, dtype=float) * self.gains[:, None], 0.0, 1.0)
+        return np.rint(duties * resolution).astype(np.int64).ravel()
+
+    def diff(self, quantized, last=None, resolution=100):
+        """Return {pin: duty} of the channels that differ from `last`."""
+        changed = self.connected.copy() if last is None else (quantized != last) & self.connected
+        return dict(zip(self.flat_pins[changed].tolist(),
+                        (quantized[changed] / float(resolution)).tolist()))
+
+    def expand(self, duties):
+        """Replace the logical channels in {pin: duty} with the pins of all zones."""
+        expanded = {}
+        rgb = [None, None, None]
+        for pin, duty in duties.items():
+            if is_channel(pin):
+                rgb[pin - CHANNEL_PIN] = duty
+            else:
+                expanded[pin] = duty
+        for idx, duty in enumerate(rgb):
+            if duty is not None:
+                for zone, pin in enumerate(self.pins[:, idx].tolist()):
+                    if pin:
+                        expanded[pin] = min(max(duty * self.gains[zone], 0.0), 1.0)
+        return expanded
+
+    def set_color(self, rgb):
+        """Set every zone to a color (or one color per zone) in a single write."""
+        return cg.set_pwm_many(self.diff(self.render(rgb)))
+
+
+def _suffix(zone):
+    """Return the suffix of the pins.ini options of a zone ('', '_2', etc.)."""
+    return '_{}'.format(zone + 1) if zone else ''
+
+
+def zone_pins():
+    """Read the [red, green, blue] pins of each zone from pins.ini."""
+    pins = []
+    while True:
+        suffix = _suffix(len(pins))
+        try:
+            zone = [cg.get_pin('RGB_Strip', 'pin_{}{}'.format(color, suffix)) for color in COLORS]
+        except Exception:  # noqa
+            break
+        if not any(zone):
+            break
+        pins.append(zone)
+    return pins
+
+
+def load():
+    """Read the zones from pins.ini."""
+    pins = zone_pins()
+    gains = []
+    for zone in range(len(pins)):
+        try:
+            gains.append(float(cg.get_pin('RGB_Strip', 'gain{}'.format(_suffix(zone)))))
+        except Exception:  # noqa
+            gains.append(1.0)
+    return Zones(pins, gains)
+
+
+_strips = None
+
+
+def strips():
+    """Return the zones defined in pins.ini (loaded once)."""
+    global _strips
+    if _strips is None:
+        _strips = load()
+    return _strips
@@ -0,0 +1,132 @@
+"""Automatic tests, run against the hardware simulator.
+
+Runs in its own process with a temporary socket and log, so it never drives
+the real outputs and is safe to run next to main.py:
+
+    python simtests.py
+
+The tests that need an operator are in modules/tests.py.
+
+"""
+
+import glob
+import os
+import re
+import shutil
+import sys
+import tempfile
+
+os.environ['PIALARM_SIMULATE'] = '1'  # before the hardware modules are imported
+WORK_DIR = tempfile.mkdtemp(prefix='pialarm-tests-')
+os.environ['PIALARM_LOG'] = os.path.join(WORK_DIR, 'pialarm.log')
+
+from modules import config as cg  # noqa: E402
+from modules import alarm, bootPiBlaster, commands, lcd, sequences, server  # noqa: E402
+from modules.context import IO  # noqa: E402
+
+
+class patched(object):
+    """Temporarily replace a module attribute (ex: to not send IFTTT texts)."""
+
+    def __init__(self, module, name, value):
+        """Initializer."""
+        self.module = module
+        self.name = name
+        self.value = value
+
+    def __enter__(self):
+        """Swap in the replacement."""
+        self.original = getattr(self.module, self.name)
+        setattr(self.module, self.name, self.value)
+        return self.value
+
+    def __exit__(self, *exc_info):
+        """Restore the original."""
+        setattr(self.module, self.name, self.original)
+
+
+def check(expected, actual, what):
+    """Raise an AssertionError if the values differ."""
+    if expected != actual:
+        raise AssertionError('{}: expected {!r}, got {!r}'.format(what, expected, actual))
+
+
+#
+# Tests
+#
+
+
+def t_providers():
+    """Check that every op registered in a module is in commands.PROVIDERS."""
+    registered = re.compile(r"^@commands\.register\('(\w+)'", re.MULTILINE)
+    modules_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'modules')
+    for path in glob.glob(os.path.join(modules_dir, '*.py')):
+        module = os.path.splitext(os.path.basename(path))[0]
+        with open(path) as source:
+            for name in registered.findall(source.read()):
+                check(module, commands.PROVIDERS.get(name), 'PROVIDERS[{!r}]'.format(name))
+
+
+def t_alarm_failure():
+    """Check that a failing stage ends the alarm and turns everything off."""
+    shaker = cg.get_pin('Haptics', 'pin_shaker')
+    raw = {'delay': 0, 'stages': [{'duration': 1, 'pwm': {'shaker': 0.5}}]}
+    session = alarm.AlarmSession(sequences.compile_sequence('failure', raw))
+
+    def fail(duration, timeline=None):
+        check(0.5, cg.pwm_snapshot().get(shaker), 'shaker during the stage')
+        raise RuntimeError('Forced stage failure')
+    session.wait_stage = fail
+    with patched(cg, 'check_status', lambda: True), patched(lcd, 'brightness', lambda raw: None):
+        session.run()
+    check('failed', session.state, 'session state')
+    check(False, session.is_active(), 'session active')
+    check(0, cg.pwm_snapshot().get(shaker), 'shaker after the failure')
+    check(False, alarm.off_button in IO.callbacks, 'off button callback registered')
+
+
+def t_pwm_resync():
+    """Check that bootPiBlaster.py gets main.py to resync the PWM pins."""
+    service = server.serve(os.path.join(WORK_DIR, 'pialarm.sock'))
+    calls = []
+    try:
+        with patched(cg, 'resync_pwm', lambda: calls.append(True)):
+            reply = bootPiBlaster.resync(service.path)
+    finally:
+        service.shutdown()
+        service.server_close()
+    check(True, reply['ok'], 'reply ok ({})'.format(reply.get('error')))
+    check(1, len(calls), 'calls to cg.resync_pwm()')
+
+
+def t_pwm_shadow():
+    """Check that the PWM duties are tracked when not on a Pi."""
+    buzzer = cg.get_pin('Haptics', 'pin_buzzer')
+    with patched(cg, '_blaster', None), patched(cg, 'is_pi', lambda: False):
+        cg.set_pwm(buzzer, 0.25)
+    check(0.25, cg.pwm_snapshot().get(buzzer), 'buzzer duty')
+
+
+TESTS = [t_providers, t_alarm_failure, t_pwm_resync, t_pwm_shadow]
+
+
+def run():
+    """Run every test and return the number of failures."""
+    cg.ifttt = lambda *args, **kwargs: None  # no texts from the tests
+    failures = 0
+    for test in TESTS:
+        try:
+            test()
+            print 'ok      {}'.format(test.__name__)
+        except Exception as err:  # noqa
+            failures += 1
+            print 'FAILED  {}: {}'.format(test.__name__, err)
+    return failures
+
+
+if __name__ == '__main__':
+    try:
+        failures = run()
+    finally:
+        shutil.rmtree(WORK_DIR, ignore_errors=True)
+    sys.exit(1 if failures else 0)